@@ -1,11 +1,23 @@
 import sys
 import os
-from flask import Flask, request, jsonify
+import resource
+import time
+from flask import Flask, request, jsonify, g, send_from_directory
 from pydantic import BaseModel, ValidationError
 from dotenv import load_dotenv
 from flasgger import Swagger
-from scripts.model_prediction import predict_category, confirm_category
-from scripts.generative_ai import generate_category_by_gemini, verify_predicted_category_is_correct_by_gemini
+from scripts.model_prediction import (
+    predict_category_details, confirm_category, get_model_bundle_memory,
+    get_prediction_cache_stats, get_prediction_dispatcher_stats
+)
+from scripts.generative_ai import review_prediction_by_gemini, get_gemini_client_stats
+from scripts.category_matcher import learn_category_alias
+from scripts.admission import (
+    AdmissionController, DeadlineExceeded, RETRY_AFTER_SECONDS,
+    clear_deadline, resolve_queue_time, resolve_request_timeout, start_deadline
+)
+from scripts.profiling import PROFILE_HEADER, RequestProfiler, is_admin
+from scripts.shadow import create_shadow_evaluator
 
 # Add the project directory to the Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -22,6 +34,55 @@ app = Flask(__name__)
 # Initialize Swagger for API documentation
 Swagger(app)
 
+# Per-worker in-flight limit and degraded-mode switch for /predict
+admission_controller = AdmissionController()
+
+# Opt-in per-worker profiler, armed through the admin endpoints or the X-Profile header
+request_profiler = RequestProfiler()
+
+# Candidate model scored on sampled /predict traffic in the background; None when SHADOW_MODEL_DIR is unset
+shadow_evaluator = create_shadow_evaluator()
+
+def skipped_review(category, reason):
+    """
+    Build the Gemini review returned when the Gemini stages are skipped.
+    
+    Args:
+        category (str): The category predicted by the model.
+        reason (str): Why the review was skipped.
+    
+    Returns:
+        dict: The suggested category, verification status and reason.
+    """
+    return {"suggested_category": category or 'none', "status": "skipped", "reason": reason}
+
+def admin_forbidden():
+    """
+    Build the response for admin requests without a valid X-Admin-Token header.
+    
+    Returns:
+        tuple: The error response and status code, or None if the request is authorized.
+    """
+    if is_admin(request.headers):
+        return None
+    return jsonify({"error": "A valid X-Admin-Token header is required."}), 403
+
+@app.before_request
+def start_request_profile():
+    # Only one attribute check per request while the profiler is disarmed
+    if request_profiler.remaining <= 0 and PROFILE_HEADER not in request.headers:
+        return
+    if request.path.startswith('/admin/'):
+        return
+    requested_mode = request.headers.get(PROFILE_HEADER) if is_admin(request.headers) else None
+    g.profile_session = request_profiler.start(requested_mode)
+
+@app.teardown_request
+def stop_request_profile(exc):
+    session = g.pop('profile_session', None)
+    if session is not None:
+        request_profiler.stop(session, f"{request.method}-{request.path}")
+
 # Pydantic models for request and response validation
 class PredictionRequest(BaseModel):
     service_description: str
@@ -32,6 +93,7 @@ class PredictionResponse(BaseModel):
     suggested_by_gen_ai: str
     verification_status_by_gen_ai: str
     verification_reason_by_gen_ai: str
+    prediction_source: str
 
 class ConfirmationRequest(BaseModel):
     service_description: str
@@ -70,6 +132,16 @@ def predict():
               example: "Fix a leaking pipe"
           required:
             - service_description
+      - name: X-Request-Timeout-Ms
+        in: header
+        type: number
+        required: false
+        description: Time budget for the request in milliseconds, capped by REQUEST_TIMEOUT_MS
+      - name: X-Request-Start
+        in: header
+        type: string
+        required: false
+        description: Time the proxy received the request ('t=<seconds>'); queueing time counts against the budget
     responses:
         200:
             description: Category prediction response
@@ -86,11 +158,26 @@ def predict():
                         type: string
                     verification_reason_by_gen_ai:
                         type: string
+                    prediction_source:
+                        type: string
+                        description: "'exact_match' when answered from the exact-match index, 'similarity' when the nearest training description answered, otherwise 'model'"
         422:
             description: Validation Error
         500:
             description: Internal Server Error
+        503:
+            description: Service overloaded; retry after the Retry-After header
+        504:
+            description: Request deadline exceeded
     """
+    # Shed load when this worker already has too many requests in flight
+    if not admission_controller.try_acquire(resolve_queue_time(request.headers)):
+        response = jsonify({"error": "Service is overloaded. Please retry later."})
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return response, 503
+
+    started_at = time.perf_counter()
+    deadline_token = start_deadline(resolve_request_timeout(request.headers))
     try:
         data = request.get_json()
         
@@ -101,31 +188,42 @@ def predict():
         # Process the input
         service_description = data['service_description'].strip()
         
-        # Predict category using the trained model
-        category, confidence = predict_category(service_description)
+        # Predict category using the exact-match index or the trained model
+        prediction = predict_category_details(service_description)
+        category, confidence = prediction['category'], prediction['confidence']
+        if shadow_evaluator is not None:
+            shadow_evaluator.submit(service_description, prediction)
         
-        # Generate category using generative AI (Gemini)
-        suggested_by_gemini = generate_category_by_gemini(service_description)
-
-        # Verify if the predicted category is correct using generative AI (Gemini)
-        verification_result_by_gemini = verify_predicted_category_is_correct_by_gemini(
-            service_description, category
-        )
+        # Suggest and verify the category using generative AI (Gemini), unless the worker is degraded
+        if admission_controller.should_degrade():
+            review_by_gemini = skipped_review(category, "Gemini review skipped because the service is under load.")
+        else:
+            try:
+                review_by_gemini = review_prediction_by_gemini(service_description, category)
+            except DeadlineExceeded:
+                review_by_gemini = skipped_review(category, "Gemini review skipped because the request deadline was reached.")
 
         response_data = {
             "confidence": confidence,
             "category": category,
-            "suggested_by_gen_ai": suggested_by_gemini.lower(),
-            "verification_status_by_gen_ai": verification_result_by_gemini.get('status', 'unknown'),
-            "verification_reason_by_gen_ai": verification_result_by_gemini.get('reason', 'N/A')
+            "suggested_by_gen_ai": review_by_gemini['suggested_category'].lower(),
+            "verification_status_by_gen_ai": review_by_gemini['status'],
+            "verification_reason_by_gen_ai": review_by_gemini['reason'],
+            "prediction_source": prediction['source']
         }
 
         return jsonify(response_data), 200
 
+    except DeadlineExceeded as e:
+        admission_controller.record_deadline_exceeded()
+        return jsonify({"detail": str(e)}), 504
     except ValidationError as e:
         return jsonify(e.errors()), 422
     except Exception as e:
         return jsonify({"detail": "Internal Server Error: " + str(e)}), 500
+    finally:
+        clear_deadline(deadline_token)
+        admission_controller.release((time.perf_counter() - started_at) * 1000.0)
 
 
 # Endpoint for confirming a predicted category
@@ -167,10 +265,185 @@ def confirm():
             return jsonify(e.errors()), 422
 
         confirm_category(request_data.service_description, request_data.confirmed_category)
+        learn_category_alias(request_data.service_description, request_data.confirmed_category)
+        if shadow_evaluator is not None:
+            shadow_evaluator.record_feedback(request_data.service_description, request_data.confirmed_category)
         return jsonify({"message": "Category confirmed successfully."})
     except Exception as e:
         return jsonify({"detail": str(e)}), 500
 
+# Endpoint for runtime metrics of this worker
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Runtime metrics of the serving worker.
+    ---
+    responses:
+        200:
+            description: Worker metrics
+            schema:
+                type: object
+                properties:
+                    prediction_cache:
+                        type: object
+                    prediction_dispatcher:
+                        type: object
+                    admission:
+                        type: object
+                    gemini:
+                        type: object
+                    shadow:
+                        type: object
+    """
+    return jsonify({
+        "prediction_cache": get_prediction_cache_stats(),
+        "prediction_dispatcher": get_prediction_dispatcher_stats(),
+        "admission": admission_controller.stats(),
+        "gemini": get_gemini_client_stats(),
+        "shadow": shadow_evaluator.stats() if shadow_evaluator is not None else None
+    })
+
+# Admin endpoints for profiling this worker
+@app.route("/admin/profiling", methods=["GET"])
+def profiling_status():
+    """
+    Profiler state and the profile files written by this worker.
+    ---
+    parameters:
+      - name: X-Admin-Token
+        in: header
+        type: string
+        required: true
+    responses:
+        200:
+            description: Profiler state
+        403:
+            description: Missing or invalid admin token
+    """
+    forbidden = admin_forbidden()
+    if forbidden:
+        return forbidden
+    return jsonify(request_profiler.status())
+
+@app.route("/admin/profiling", methods=["POST"])
+def arm_profiling():
+    """
+    Profile the next requests handled by this worker.
+    ---
+    parameters:
+      - name: X-Admin-Token
+        in: header
+        type: string
+        required: true
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            mode:
+              type: string
+              enum: [cprofile, sampling]
+              example: "cprofile"
+            requests:
+              type: integer
+              example: 10
+              description: Number of requests to profile, capped by PROFILE_MAX_REQUESTS (0 disarms)
+          required:
+            - mode
+    responses:
+        200:
+            description: Profiler state
+        403:
+            description: Missing or invalid admin token
+        422:
+            description: Validation Error
+    """
+    forbidden = admin_forbidden()
+    if forbidden:
+        return forbidden
+    data = request.get_json(silent=True) or {}
+    try:
+        request_profiler.arm(data.get('mode'), data.get('requests', 1))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 422
+    return jsonify(request_profiler.status())
+
+@app.route("/admin/profiling/memory", methods=["POST"])
+def profile_memory():
+    """
+    Write a tracemalloc snapshot and a memory report of this worker.
+    ---
+    parameters:
+      - name: X-Admin-Token
+        in: header
+        type: string
+        required: true
+    responses:
+        200:
+            description: Memory report with the written file names
+        403:
+            description: Missing or invalid admin token
+    """
+    forbidden = admin_forbidden()
+    if forbidden:
+        return forbidden
+    components = {
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "model_bundles": get_model_bundle_memory(),
+        "prediction_cache_bytes": get_prediction_cache_stats()['bytes'],
+    }
+    return jsonify(request_profiler.snapshot_memory(components))
+
+@app.route("/admin/profiling/memory", methods=["DELETE"])
+def stop_memory_profiling():
+    """
+    Stop tracemalloc on this worker.
+    ---
+    parameters:
+      - name: X-Admin-Token
+        in: header
+        type: string
+        required: true
+    responses:
+        200:
+            description: Profiler state
+        403:
+            description: Missing or invalid admin token
+    """
+    forbidden = admin_forbidden()
+    if forbidden:
+        return forbidden
+    request_profiler.stop_memory_tracing()
+    return jsonify(request_profiler.status())
+
+@app.route("/admin/profiling/files/<path:filename>", methods=["GET"])
+def download_profile(filename):
+    """
+    Download a profile file written by this worker.
+    ---
+    parameters:
+      - name: X-Admin-Token
+        in: header
+        type: string
+        required: true
+      - name: filename
+        in: path
+        type: string
+        required: true
+    responses:
+        200:
+            description: The profile file
+        403:
+            description: Missing or invalid admin token
+        404:
+            description: Profile not found
+    """
+    forbidden = admin_forbidden()
+    if forbidden:
+        return forbidden
+    return send_from_directory(os.path.abspath(request_profiler.profile_dir), filename, as_attachment=True)
+
 # Custom error handler for 404 errors
 @app.errorhandler(404)
 def page_not_found(e):
@@ -8,9 +8,12 @@ from sqlalchemy.engine import URL
 # Load environment variables from .env file
 load_dotenv()
 
-def create_engine():
+def create_engine(connection_timeout=30):
     """
     Create and return a SQLAlchemy engine using environment variables.
+
+    Args:
+        connection_timeout (int): Seconds to wait for a connection to the server.
     """
     try:
         connection_string = (
@@ -19,7 +22,7 @@ def create_engine():
                 f"Database={os.getenv('DATABASE_NAME')};"
                 f"Uid={os.getenv('DATABASE_USERNAME')};"
                 f"Pwd={os.getenv('DATABASE_PASSWORD')};"
-                f"Encrypt=no;TrustServerCertificate=yes;Connection Timeout=30;"
+                f"Encrypt=no;TrustServerCertificate=yes;Connection Timeout={connection_timeout};"
             )
         connection_url = URL.create(
             "mssql+pyodbc",
@@ -31,10 +34,13 @@ def create_engine():
         print(f"Error creating engine: {e}")
         raise e
 
-def create_session():
+def create_session(connection_timeout=30):
     """
     Create and return a SQLAlchemy session.
+
+    Args:
+        connection_timeout (int): Seconds to wait for a connection to the server.
     """
-    engine = create_engine()
+    engine = create_engine(connection_timeout)
     Session = sessionmaker(bind=engine)
     return Session()
\ No newline at end of file
@@ -1,9 +1,11 @@
+import math
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 import pandas as pd
 from database.models import ServiceRequest, Category
 from database.db_session import create_session
+from scripts.near_duplicates import filter_near_duplicates
 
 def get_category_id(category_name):
     """
@@ -60,6 +62,55 @@ def fetch_all_service_requests():
     finally:
         session.close()
 
+def stream_service_requests(after_id=0, chunksize=5000, feedback_only=False):
+    """
+    Stream service requests with an id above a watermark, one chunk per query.
+    
+    Rows are read in id order with keyset pagination, so a caller can persist the
+    last id it has seen and resume from there.
+    
+    Args:
+        after_id (int): Only rows with a larger id are returned.
+        chunksize (int): Maximum number of rows per chunk.
+        feedback_only (bool, optional): Only stream feedback rows.
+    
+    Yields:
+        DataFrame: Chunks with id, service_description, category, confirmed_category and is_feedback columns.
+    """
+    session = create_session()
+    query = text("""
+    SELECT TOP (:chunksize)
+        sr.id,
+        sr.service_description,
+        c_pred.name AS category,
+        c_user.name AS confirmed_category,
+        sr.is_feedback
+    FROM 
+        service_requests sr
+    LEFT JOIN 
+        categories c_pred ON sr.predicted_category_id = c_pred.id
+    LEFT JOIN 
+        categories c_user ON sr.user_confirmed_category_id = c_user.id
+    WHERE 
+        sr.id > :after_id
+        AND (:feedback_only = 0 OR sr.is_feedback = 1)
+    ORDER BY 
+        sr.id
+    """)
+    try:
+        while True:
+            chunk = pd.read_sql(query, session.bind, params={"chunksize": chunksize, "after_id": after_id, "feedback_only": int(feedback_only)})
+            if chunk.empty:
+                return
+            yield chunk
+            after_id = int(chunk['id'].max())
+            if len(chunk) < chunksize:
+                return
+    except SQLAlchemyError as e:
+        print(f"Error streaming service requests: {e}")
+    finally:
+        session.close()
+
 def normalize_data(df):
     """
     Normalize the text data by converting to lowercase and stripping whitespace.
@@ -78,6 +129,9 @@ def import_csv_to_db(csv_file):
     """
     Import data from a CSV file into the database, identifying and inserting new rows.
     
+    Rows that are near-duplicates of a stored row or of another new row with the
+    same category are not inserted.
+    
     Args:
         csv_file (str): The path to the CSV file.
     """
@@ -97,6 +151,9 @@ def import_csv_to_db(csv_file):
         new_data = csv_data.merge(db_data, on=['service_description', 'category'], how='left', indicator=True)
         new_data = new_data[new_data['_merge'] == 'left_only'].drop(columns=['_merge'])
         
+        # Skip rows that only rephrase a stored row or another new row of the same category
+        new_data = filter_near_duplicates(new_data, db_data)
+        
         # Show the missing rows
         if not new_data.empty:
             print("Missing rows to be inserted:")
@@ -155,7 +212,7 @@ def get_feedback_data():
            c1.name as predicted_category, 
            c2.name as user_confirmed_category
     FROM service_requests sr
-    JOIN categories c1 ON sr.predicted_category_id = c1.id
+    LEFT JOIN categories c1 ON sr.predicted_category_id = c1.id
     LEFT JOIN categories c2 ON sr.user_confirmed_category_id = c2.id
     WHERE sr.is_feedback = 1
     """
@@ -168,15 +225,22 @@ def get_feedback_data():
     finally:
         session.close()
 
-def get_existing_categories():
+def get_existing_categories(timeout=None):
     """
     Retrieve all existing categories from the database.
     
+    Args:
+        timeout (float, optional): Seconds left for connecting and running the query.
+    
     Returns:
         list: A list of category names.
     """
-    session = create_session()
+    # ODBC timeouts are whole seconds, and 0 would mean no timeout at all
+    seconds = None if timeout is None else max(1, math.ceil(timeout))
+    session = create_session(seconds or 30)
     try:
+        if seconds:
+            session.connection().connection.dbapi_connection.timeout = seconds
         result = session.execute(text("SELECT name FROM categories"))
         categories = [row[0] for row in result]
         return categories if categories else []
@@ -0,0 +1,242 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+
+# Default request budget, overridable per request with the X-Request-Timeout-Ms header
+REQUEST_TIMEOUT_MS = float(os.getenv('REQUEST_TIMEOUT_MS', 10000))
+REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+
+# Time the proxy received the request ('t=<seconds>' as set by nginx with ${msec}), so that
+# time spent in the gunicorn backlog counts against the budget
+REQUEST_START_HEADER = 'X-Request-Start'
+
+# Load shedding: in-flight cap per worker (0 disables it), maximum time a request may have waited
+# before reaching a worker (0 disables it) and the Retry-After hint for rejected requests.
+# The in-flight defaults assume gthread workers with --threads 8 (see Server-Setup.md).
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', 6))
+MAX_QUEUE_MS = float(os.getenv('MAX_QUEUE_MS', 2000))
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', 1))
+
+# Degraded mode skips the Gemini stages when in-flight requests or recent p95 latency cross these (0 disables)
+DEGRADE_IN_FLIGHT = int(os.getenv('DEGRADE_IN_FLIGHT', 4))
+DEGRADE_LATENCY_MS = float(os.getenv('DEGRADE_LATENCY_MS', 5000))
+
+# The latency check looks at requests finished in the last N seconds, and only once it has this many of them
+DEGRADE_LATENCY_WINDOW_SECONDS = float(os.getenv('DEGRADE_LATENCY_WINDOW_SECONDS', 60))
+DEGRADE_LATENCY_MIN_SAMPLES = int(os.getenv('DEGRADE_LATENCY_MIN_SAMPLES', 5))
+
+# Upper bound on the latencies kept in the window
+MAX_LATENCY_SAMPLES = 10000
+
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a request runs out of its time budget before a stage starts.
+    """
+
+def resolve_queue_time(headers):
+    """
+    Get the time a request waited between the proxy and the worker from the X-Request-Start header.
+
+    Args:
+        headers: The request headers.
+
+    Returns:
+        float: The queueing time in seconds (0 when the header is missing or invalid).
+    """
+    value = headers.get(REQUEST_START_HEADER)
+    if not value:
+        return 0.0
+    try:
+        started_at = float(value.strip().removeprefix('t='))
+    except ValueError:
+        return 0.0
+    # Some proxies send milliseconds or microseconds instead of seconds
+    while started_at > 1e11:
+        started_at /= 1000.0
+    return max(0.0, time.time() - started_at)
+
+def resolve_request_timeout(headers):
+    """
+    Get the request time budget from the request headers or the configured default,
+    minus the time the request already spent queued before reaching the worker.
+
+    Args:
+        headers: The request headers.
+
+    Returns:
+        float: The time budget in seconds.
+    """
+    try:
+        timeout_ms = float(headers.get(REQUEST_TIMEOUT_HEADER, REQUEST_TIMEOUT_MS))
+    except (TypeError, ValueError):
+        timeout_ms = REQUEST_TIMEOUT_MS
+    # Clients may shorten the budget but not extend it past the configured default
+    timeout = max(0.0, min(timeout_ms, REQUEST_TIMEOUT_MS)) / 1000.0
+    return max(0.0, timeout - resolve_queue_time(headers))
+
+def start_deadline(timeout):
+    """
+    Set the deadline of the current request.
+
+    Args:
+        timeout (float): The time budget in seconds.
+
+    Returns:
+        contextvars.Token: Token for resetting the deadline when the request ends.
+    """
+    return _deadline.set(time.monotonic() + timeout)
+
+def clear_deadline(token):
+    """
+    Reset the deadline set by start_deadline.
+
+    Args:
+        token (contextvars.Token): The token returned by start_deadline.
+    """
+    _deadline.reset(token)
+
+def remaining_time():
+    """
+    Return the time left before the current request's deadline.
+
+    Returns:
+        float: Seconds left (may be negative), or None when no deadline is set.
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def check_deadline(stage):
+    """
+    Raise if the current request has no time left for the given stage.
+
+    Args:
+        stage (str): Name of the stage about to start.
+
+    Raises:
+        DeadlineExceeded: If the deadline has passed.
+    """
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before the {stage} stage.")
+
+class AdmissionController:
+    """
+    Per-worker admission control: caps in-flight requests, sheds requests that
+    waited too long in the backlog and tells callers when to run degraded
+    because the worker is busy or slow.
+
+    With sync gunicorn workers only one request is in flight per worker, so the
+    queueing-time and latency checks are the ones that apply there.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, degrade_in_flight=DEGRADE_IN_FLIGHT,
+                 degrade_latency_ms=DEGRADE_LATENCY_MS, max_queue_ms=MAX_QUEUE_MS,
+                 window_seconds=DEGRADE_LATENCY_WINDOW_SECONDS, min_samples=DEGRADE_LATENCY_MIN_SAMPLES):
+        """
+        Args:
+            max_in_flight (int): Maximum concurrent requests (0 disables shedding).
+            max_queue_ms (float): Maximum time a request may have waited before reaching the worker (0 disables it).
+            degrade_in_flight (int): In-flight count from which Gemini stages are skipped (0 disables).
+            degrade_latency_ms (float): Recent p95 latency from which Gemini stages are skipped (0 disables).
+            window_seconds (float): Age of the latencies the p95 is computed over.
+            min_samples (int): Latencies needed in the window before the latency check applies.
+        """
+        self.max_in_flight = max_in_flight
+        self.degrade_in_flight = degrade_in_flight
+        self.degrade_latency_ms = degrade_latency_ms
+        self.max_queue_ms = max_queue_ms
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.degraded_requests = 0
+        self.deadline_exceeded = 0
+        self.window_seconds = window_seconds
+        self.min_samples = max(1, min_samples)
+        # (finished_at, latency_ms) of recent requests, oldest first
+        self._latencies = deque(maxlen=MAX_LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def try_acquire(self, queue_time=0.0):
+        """
+        Admit a request if the worker has capacity and the request is not stale.
+
+        Args:
+            queue_time (float): Seconds the request waited before reaching the worker.
+
+        Returns:
+            bool: True if the request was admitted, False if it should be shed.
+        """
+        with self._lock:
+            if (
+                (self.max_in_flight > 0 and self.in_flight >= self.max_in_flight)
+                or (self.max_queue_ms > 0 and queue_time * 1000.0 > self.max_queue_ms)
+            ):
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, latency_ms):
+        """
+        Mark an admitted request as finished.
+
+        Args:
+            latency_ms (float): The request latency in milliseconds.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._latencies.append((time.monotonic(), latency_ms))
+
+    def record_deadline_exceeded(self):
+        with self._lock:
+            self.deadline_exceeded += 1
+
+    def should_degrade(self):
+        """
+        Decide whether the current request should skip the Gemini stages.
+
+        Returns:
+            bool: True when in-flight requests or recent latency are above the thresholds.
+        """
+        with self._lock:
+            degraded = (
+                (self.degrade_in_flight > 0 and self.in_flight >= self.degrade_in_flight)
+                or (self.degrade_latency_ms > 0 and self._p95_latency() > self.degrade_latency_ms)
+            )
+            if degraded:
+                self.degraded_requests += 1
+            return degraded
+
+    def stats(self):
+        """
+        Return admission counters for this worker.
+
+        Returns:
+            dict: In-flight, admitted, shed, degraded and deadline counters and recent p95 latency.
+        """
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "degraded": self.degraded_requests,
+                "deadline_exceeded": self.deadline_exceeded,
+                "latency_p95_ms": self._p95_latency(),
+            }
+
+    def _p95_latency(self):
+        # A time window rather than a request count, so a slow period stops counting after
+        # window_seconds however little traffic the worker gets
+        cutoff = time.monotonic() - self.window_seconds
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+        if len(self._latencies) < self.min_samples:
+            return 0.0
+        latencies = sorted(latency for _, latency in self._latencies)
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+class MicroBatchDispatcher:
+    """
+    Coalesces concurrent single-item requests into batches.
+
+    Callers submit one item and get a Future. A background thread takes the
+    first queued item, keeps collecting until the batch window elapses or the
+    batch is full, scores the batch with one call to `batch_fn`, and resolves
+    each caller's future with its own result.
+    """
+
+    def __init__(self, batch_fn, window_ms=2.0, max_batch_size=32):
+        """
+        Args:
+            batch_fn (callable): Maps a list of items to a list of results of the same length.
+            window_ms (float): Maximum time to wait for more items after the first one.
+            max_batch_size (int): Maximum number of items scored together.
+        """
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        self._batch_sizes = deque(maxlen=1024)
+        self._wait_times = deque(maxlen=1024)
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+
+    def submit(self, item):
+        """
+        Queue an item for the next batch.
+
+        Args:
+            item: The item to score.
+
+        Returns:
+            Future: Resolves to the item's result.
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def stats(self):
+        """
+        Return queue depth, batch size and wait time metrics.
+
+        Returns:
+            dict: Dispatcher metrics for this worker.
+        """
+        with self._lock:
+            batch_sizes = sorted(self._batch_sizes)
+            wait_times = sorted(self._wait_times)
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_batch_size": self.max_batch_size,
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "errors": self.errors,
+                "mean_batch_size": sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+                "max_batch_size_seen": batch_sizes[-1] if batch_sizes else 0,
+                "wait_ms_p50": _percentile(wait_times, 0.50) * 1000.0,
+                "wait_ms_p99": _percentile(wait_times, 0.99) * 1000.0,
+            }
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='prediction-dispatcher', daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Callers that gave up before scoring started have cancelled their futures
+            batch = [entry for entry in self._collect() if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started_at = time.perf_counter()
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                print(f"Error in batch dispatch: {e}")
+                with self._lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self._batch_sizes.append(len(batch))
+                self._wait_times.extend(started_at - queued_at for _, _, queued_at in batch)
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def create_batch_dispatcher(batch_fn):
+    """
+    Create a dispatcher configured from environment variables.
+
+    Batching only pays off when a worker serves concurrent requests (gunicorn gthread
+    workers with --threads). Under sync workers every batch holds one item and the
+    window is added to each request, so PREDICT_BATCH_WINDOW_MS should stay 0 there.
+
+    Args:
+        batch_fn (callable): Maps a list of items to a list of results.
+
+    Returns:
+        MicroBatchDispatcher: The dispatcher, or None when PREDICT_BATCH_WINDOW_MS is 0.
+    """
+    window_ms = float(os.getenv('PREDICT_BATCH_WINDOW_MS', 0))
+    if window_ms <= 0:
+        return None
+    return MicroBatchDispatcher(
+        batch_fn,
+        window_ms=window_ms,
+        max_batch_size=int(os.getenv('PREDICT_BATCH_MAX_SIZE', 32))
+    )
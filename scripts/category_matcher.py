@@ -0,0 +1,325 @@
+import os
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+from database.repositories import get_existing_categories
+from scripts.category_store import CategoryStore
+from scripts.data_preprocessing import preprocess_text
+from scripts.model_prediction import load_model_bundle
+from scripts.similarity_corpus import SIMILARITY_BLOCK_ROWS, dequantize_rows
+from train_model import get_average_word2vec
+
+# Minimum similarity for a local match; below it the LLM synonym lookup is used.
+# Tuned on data/category_match_examples.csv (python -m scripts.category_matcher)
+CATEGORY_MATCH_THRESHOLD = float(os.getenv('CATEGORY_MATCH_THRESHOLD', 0.6))
+
+# Labelled suggestions used to tune the threshold (an empty category means no match is expected)
+CATEGORY_MATCH_EXAMPLES_PATH = 'data/category_match_examples.csv'
+
+# Word prefix length used for token containment, so that 'painter' and 'painting' share a stem
+NAME_STEM_LENGTH = 5
+
+# How often to reload categories from the database; learned aliases are picked up as soon as they change
+CATEGORY_MATCHER_REFRESH_SECONDS = float(os.getenv('CATEGORY_MATCHER_REFRESH_SECONDS', 300))
+
+def normalize_category_name(name):
+    """
+    Normalize a category name or suggestion the same way descriptions are preprocessed.
+
+    Args:
+        name (str): The category name.
+
+    Returns:
+        str: The normalized name.
+    """
+    return preprocess_text(name or '').strip() or (name or '').lower().strip()
+
+def name_stems(text):
+    """
+    Split a normalized name into its set of word prefixes.
+
+    Args:
+        text (str): The normalized name or suggestion.
+
+    Returns:
+        set: The prefixes of the words of at least three letters.
+    """
+    return {token[:NAME_STEM_LENGTH] for token in re.findall(r'[a-z]+', text.lower()) if len(token) >= 3}
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+class CategoryMatcher:
+    """
+    Maps free-text category suggestions onto existing categories.
+
+    Exact name matches are dictionary lookups. Everything else is scored
+    against precomputed, L2-normalized Word2Vec and TF-IDF vectors of the
+    category names and training-description centroids, and by the share of a
+    name's word stems that the suggestion contains, taking the best of the
+    three scores. Learned aliases are only consulted when no category scores
+    above the threshold, so feedback cannot override a confident match.
+    """
+
+    def __init__(self, categories, word2vec, tfidf, aliases=None, version=None, centroids=None,
+                 aliases_updated_at=None):
+        """
+        Args:
+            categories (list): Existing category names.
+            word2vec: Trained Word2Vec model.
+            tfidf: Fitted TF-IDF vectorizer.
+            aliases (dict, optional): Normalized alias to category name.
+            version (str, optional): Model version the vectors were built with.
+            centroids (dict, optional): Category name to the mean combined vector of its training descriptions.
+            aliases_updated_at (float, optional): Time of the latest alias change included in aliases.
+        """
+        self.categories = list(categories)
+        self.word2vec = word2vec
+        self.tfidf = tfidf
+        self.version = version
+        self.aliases_updated_at = aliases_updated_at
+        self.built_at = time.monotonic()
+
+        # Every category is reachable through its own normalized name
+        self.lookup = {}
+        for category in self.categories:
+            self.lookup[normalize_category_name(category)] = category
+            self.lookup[category.lower().strip()] = category
+        known = set(self.categories)
+        self.aliases = {alias: category for alias, category in (aliases or {}).items() if category in known}
+
+        # Category names rarely occur in the training vocabulary, so each category is also
+        # represented by the centroid of its training descriptions
+        names = list(self.lookup.keys())
+        self.targets = [self.lookup[name] for name in names]
+        # Category names are mostly out of the vocabulary, so names are also compared
+        # by token containment ('plumbing services' contains 'plumbing')
+        self.stems = [name_stems(name) for name in names]
+        w2v_rows = [self._w2v(name) for name in names]
+        tfidf_rows = [self.tfidf.transform(names).toarray()] if names else []
+        w2v_dim = self.word2vec.vector_size
+        for category, centroid in (centroids or {}).items():
+            if category in known:
+                self.targets.append(category)
+                w2v_rows.append(centroid[:w2v_dim])
+                tfidf_rows.append(centroid[w2v_dim:].reshape(1, -1))
+
+        if self.targets:
+            self.w2v_matrix = _unit_rows(np.vstack(w2v_rows))
+            self.tfidf_matrix = _unit_rows(np.vstack(tfidf_rows))
+        else:
+            self.w2v_matrix = self.tfidf_matrix = None
+
+    def _w2v(self, normalized):
+        return get_average_word2vec(normalized.split(), self.word2vec)
+
+    def match(self, suggestion, threshold=CATEGORY_MATCH_THRESHOLD):
+        """
+        Find the existing category that best matches a suggestion.
+
+        Args:
+            suggestion (str): The suggested category name.
+            threshold (float): Score from which the vector match wins over a learned alias.
+
+        Returns:
+            tuple: The matched category (or None) and the similarity score.
+        """
+        if not suggestion or not self.targets:
+            return None, 0.0
+
+        normalized = normalize_category_name(suggestion)
+        for key in (normalized, suggestion.lower().strip()):
+            if key in self.lookup:
+                return self.lookup[key], 1.0
+
+        query_w2v = _unit_rows(self._w2v(normalized).reshape(1, -1))[0]
+        query_tfidf = _unit_rows(self.tfidf.transform([normalized]).toarray())[0]
+        query_stems = name_stems(normalized)
+        containment = np.zeros(len(self.targets))
+        containment[:len(self.stems)] = [
+            len(stems & query_stems) / len(stems) if stems else 0.0 for stems in self.stems
+        ]
+        scores = np.maximum.reduce([self.w2v_matrix @ query_w2v, self.tfidf_matrix @ query_tfidf, containment])
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            for key in (normalized, suggestion.lower().strip()):
+                if key in self.aliases:
+                    return self.aliases[key], 1.0
+        return self.targets[best], float(scores[best])
+
+def evaluate_category_matcher(matcher, examples, thresholds=np.arange(0.3, 1.0, 0.05)):
+    """
+    Measure how well the matcher maps labelled suggestions at a range of thresholds.
+
+    Args:
+        matcher (CategoryMatcher): The matcher to evaluate.
+        examples (pd.DataFrame): 'suggestion' and 'category' columns; an empty category means no match is expected.
+        thresholds (iterable): Thresholds to evaluate.
+
+    Returns:
+        pd.DataFrame: Precision, recall and the number of wrong matches per threshold.
+    """
+    expected = examples['category'].fillna('').str.lower().str.strip().to_numpy()
+    matches = [matcher.match(suggestion) for suggestion in examples['suggestion']]
+    predicted = np.array([category or '' for category, _ in matches])
+    scores = np.array([score for _, score in matches])
+
+    rows = []
+    for threshold in thresholds:
+        matched = scores >= threshold
+        correct = matched & (predicted == expected)
+        rows.append({
+            "threshold": round(float(threshold), 2),
+            "precision": float(correct.sum() / matched.sum()) if matched.any() else 1.0,
+            "recall": float(correct.sum() / (expected != '').sum()) if (expected != '').any() else 0.0,
+            "wrong_matches": int((matched & ~correct).sum()),
+        })
+    return pd.DataFrame(rows)
+
+def compute_category_centroids(bundle):
+    """
+    Compute the mean combined feature vector of the training descriptions of each category.
+
+    Args:
+        bundle (dict): The loaded model bundle.
+
+    Returns:
+        dict: Category name to centroid vector.
+    """
+    descriptions = bundle.get('descriptions')
+    corpus = bundle.get('similarity_corpus')
+    scale = bundle.get('similarity_scale')
+    if descriptions is None or corpus is None or len(descriptions) != len(corpus):
+        return {}
+    names, labels = np.unique(descriptions['category'].str.lower().str.strip().to_numpy(), return_inverse=True)
+
+    # Accumulate block by block so the memory-mapped corpus is never upcast as a whole
+    sums = np.zeros((len(names), corpus.shape[1]), dtype=np.float64)
+    for start in range(0, len(corpus), SIMILARITY_BLOCK_ROWS):
+        end = min(start + SIMILARITY_BLOCK_ROWS, len(corpus))
+        np.add.at(sums, labels[start:end], dequantize_rows(corpus, scale, slice(start, end)))
+    counts = np.bincount(labels, minlength=len(names))
+    return {name: sums[i] / counts[i] for i, name in enumerate(names)}
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+# Learned aliases and recent suggestions, shared across workers and created on first use
+_store = None
+_store_lock = threading.Lock()
+
+def get_category_store():
+    """
+    Return the shared category store, creating it on first use.
+
+    Returns:
+        CategoryStore: The store.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CategoryStore()
+    return _store
+
+def get_category_matcher():
+    """
+    Return the category matcher, rebuilding it when the model or the learned aliases change
+    or the refresh interval elapses.
+
+    Returns:
+        CategoryMatcher: The current matcher.
+    """
+    global _matcher
+    bundle = load_model_bundle()
+    store = get_category_store()
+    aliases_updated_at = store.aliases_updated_at()
+    matcher = _matcher
+    if (matcher is not None and matcher.version == bundle['version']
+            and matcher.aliases_updated_at == aliases_updated_at
+            and time.monotonic() - matcher.built_at < CATEGORY_MATCHER_REFRESH_SECONDS):
+        return matcher
+
+    with _matcher_lock:
+        if _matcher is matcher:
+            try:
+                _matcher = CategoryMatcher(
+                    get_existing_categories(),
+                    bundle['word2vec'],
+                    bundle['tfidf'],
+                    aliases=store.load_aliases(),
+                    version=bundle['version'],
+                    centroids=compute_category_centroids(bundle),
+                    aliases_updated_at=aliases_updated_at
+                )
+            except Exception as e:
+                print(f"Error building category matcher: {e}")
+                if _matcher is None:
+                    raise
+        return _matcher
+
+def match_existing_category(suggestion, threshold=CATEGORY_MATCH_THRESHOLD):
+    """
+    Match a suggested category onto an existing category locally.
+
+    Args:
+        suggestion (str): The suggested category name.
+        threshold (float): Minimum similarity for a match.
+
+    Returns:
+        str: The matched existing category, or None if no category is similar enough.
+    """
+    try:
+        category, score = get_category_matcher().match(suggestion, threshold)
+        return category if score >= threshold else None
+    except Exception as e:
+        print(f"Error in match_existing_category: {e}")
+        return None
+
+def remember_suggestion(service_description, suggested_category):
+    """
+    Remember the Gemini suggestion for a description so a later confirmation can teach an alias.
+
+    Args:
+        service_description (str): The description of the home service.
+        suggested_category (str): The suggestion returned by Gemini.
+    """
+    if not suggested_category or suggested_category.lower() == 'none':
+        return
+    try:
+        get_category_store().remember_suggestion(preprocess_text(service_description), suggested_category)
+    except Exception as e:
+        print(f"Error in remember_suggestion: {e}")
+
+def learn_category_alias(service_description, confirmed_category):
+    """
+    Count the Gemini suggestion for a confirmed description as a vote for aliasing it to the confirmed category.
+
+    The alias is only used once enough confirmations agree (see CategoryStore.load_aliases).
+
+    Args:
+        service_description (str): The description of the home service.
+        confirmed_category (str): The category confirmed by the user.
+    """
+    try:
+        store = get_category_store()
+        suggestion = store.pop_suggestion(preprocess_text(service_description))
+        if not suggestion:
+            return
+
+        category = confirmed_category.lower().strip()
+        alias = normalize_category_name(suggestion)
+        if alias == normalize_category_name(category):
+            return
+
+        # Every worker rebuilds its matcher on its next lookup, as the alias change time moves
+        store.record_alias_vote(alias, category)
+    except Exception as e:
+        print(f"Error in learn_category_alias: {e}")
+
+if __name__ == "__main__":
+    print(evaluate_category_matcher(get_category_matcher(), pd.read_csv(CATEGORY_MATCH_EXAMPLES_PATH)).to_string(index=False))
@@ -0,0 +1,172 @@
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite file shared by every gunicorn worker on the host, holding learned aliases and recent suggestions
+CATEGORY_STORE_PATH = os.getenv('CATEGORY_STORE_PATH', 'models/category_store.sqlite3')
+
+# Recent Gemini suggestions kept for learning aliases on confirmation
+MAX_RECENT_SUGGESTIONS = int(os.getenv('MAX_RECENT_SUGGESTIONS', 10000))
+
+# Confirmations needed before an alias is used, and the share of the alias's votes its category must hold
+CATEGORY_ALIAS_MIN_VOTES = int(os.getenv('CATEGORY_ALIAS_MIN_VOTES', 3))
+CATEGORY_ALIAS_MIN_SHARE = float(os.getenv('CATEGORY_ALIAS_MIN_SHARE', 0.8))
+
+class CategoryStore:
+    """
+    Shared store of the category aliases learned from confirmed feedback and of
+    the recent Gemini suggestions they are learned from.
+
+    A suggestion is remembered by the worker that served the prediction and the
+    confirmation may land on any other worker, so both live in a SQLite file
+    instead of process memory. Every write is a single transaction.
+
+    Each confirmation is stored as a vote for an (alias, category) pair, and an
+    alias is only used once enough votes agree, so a single mistaken or
+    malicious confirmation cannot redirect a suggestion.
+    """
+
+    def __init__(self, path=CATEGORY_STORE_PATH, max_suggestions=MAX_RECENT_SUGGESTIONS):
+        """
+        Args:
+            path (str): Path of the SQLite file.
+            max_suggestions (int): Maximum number of remembered suggestions.
+        """
+        self.path = path
+        self.max_suggestions = max_suggestions
+        self._local = threading.local()
+        self._init_store()
+
+    def load_aliases(self, min_votes=CATEGORY_ALIAS_MIN_VOTES, min_share=CATEGORY_ALIAS_MIN_SHARE):
+        """
+        Load the aliases whose votes agree enough to be used.
+
+        Args:
+            min_votes (int): Minimum votes for the (alias, category) pair.
+            min_share (float): Minimum share of the alias's votes held by the category.
+
+        Returns:
+            dict: Normalized alias to category name.
+        """
+        try:
+            rows = self._connection().execute(
+                "SELECT alias, category, votes, SUM(votes) OVER (PARTITION BY alias) FROM category_alias_votes"
+            ).fetchall()
+            # A strict majority is always required, so each alias maps to one category
+            return {
+                alias: category for alias, category, votes, total in rows
+                if votes >= min_votes and votes / total >= min_share and votes * 2 > total
+            }
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error loading category aliases: {e}")
+            return {}
+
+    def aliases_updated_at(self):
+        """
+        Return the time of the latest alias vote, so workers can tell when to rebuild their matcher.
+
+        Returns:
+            float: The timestamp, or None when there are no votes or the store is unavailable.
+        """
+        try:
+            return self._connection().execute("SELECT MAX(updated_at) FROM category_alias_votes").fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error reading category aliases: {e}")
+            return None
+
+    def record_alias_vote(self, alias, category):
+        """
+        Count one confirmation of a suggestion as the given category.
+
+        Args:
+            alias (str): The normalized suggestion.
+            category (str): The confirmed category name.
+        """
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "INSERT INTO category_alias_votes (alias, category, votes, updated_at) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT (alias, category) DO UPDATE SET votes = votes + 1, updated_at = excluded.updated_at",
+                    (alias, category, time.time())
+                )
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error saving category alias: {e}")
+
+    def remember_suggestion(self, key, suggestion):
+        """
+        Remember the Gemini suggestion for a preprocessed description.
+
+        Args:
+            key (str): The preprocessed service description.
+            suggestion (str): The suggested category.
+        """
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO category_suggestions (key, suggestion, stored_at) VALUES (?, ?, ?)",
+                    (key, suggestion, time.time())
+                )
+                connection.execute(
+                    "DELETE FROM category_suggestions WHERE key IN ("
+                    "SELECT key FROM category_suggestions ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_suggestions,)
+                )
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error remembering category suggestion: {e}")
+
+    def pop_suggestion(self, key):
+        """
+        Remove and return the suggestion remembered for a preprocessed description.
+
+        Args:
+            key (str): The preprocessed service description.
+
+        Returns:
+            str: The suggestion, or None if none was remembered.
+        """
+        try:
+            connection = self._connection()
+            with connection:
+                row = connection.execute(
+                    "DELETE FROM category_suggestions WHERE key = ? RETURNING suggestion", (key,)
+                ).fetchone()
+            return row[0] if row else None
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error reading category suggestion: {e}")
+            return None
+
+    def _init_store(self):
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS category_alias_votes ("
+                    "alias TEXT NOT NULL, category TEXT NOT NULL, votes INTEGER NOT NULL, "
+                    "updated_at REAL NOT NULL, PRIMARY KEY (alias, category))"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS category_suggestions ("
+                    "key TEXT PRIMARY KEY, suggestion TEXT NOT NULL, stored_at REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_category_suggestions_stored ON category_suggestions(stored_at)"
+                )
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error initializing category store: {e}")
+
+    def _connection(self):
+        # One connection per thread and process; SQLite connections must not cross a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
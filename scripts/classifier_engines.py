@@ -0,0 +1,167 @@
+import json
+import os
+import time
+import numpy as np
+import scipy.sparse as sp
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+# Available classifier engines: the RandomForest, a linear model on sparse features, or
+# a cascade that answers with the linear model when its margin is high and consults the forest otherwise
+CLASSIFIER_ENGINES = ('forest', 'linear', 'cascade')
+CLASSIFIER_ENGINE = os.getenv('CLASSIFIER_ENGINE', 'forest')
+CASCADE_MARGIN = float(os.getenv('CASCADE_MARGIN', 0.2))
+
+# Classifier confidence below which the nearest training description decides instead, answered
+# with source 'similarity' (0, the default, disables it)
+SIMILARITY_FALLBACK_CONFIDENCE = float(os.getenv('SIMILARITY_FALLBACK_CONFIDENCE', 0))
+
+if CLASSIFIER_ENGINE not in CLASSIFIER_ENGINES:
+    raise ValueError(f"Unknown CLASSIFIER_ENGINE: {CLASSIFIER_ENGINE}. Expected one of {', '.join(CLASSIFIER_ENGINES)}.")
+
+# Cores used to fit the forest and to score it at serving time (-1 uses all cores)
+FOREST_N_JOBS = int(os.getenv('FOREST_N_JOBS', -1))
+FOREST_PREDICT_N_JOBS = int(os.getenv('FOREST_PREDICT_N_JOBS', 1))
+
+# Forest tuning: candidate hyperparameters (JSON), stratified CV folds and the single-row p99 budget (0 disables it)
+FOREST_PARAM_GRID = json.loads(os.getenv('FOREST_PARAM_GRID', json.dumps({
+    'n_estimators': [50, 100, 200],
+    'max_depth': [None, 20, 40],
+    'max_features': ['sqrt', 0.3],
+})))
+FOREST_CV_FOLDS = int(os.getenv('FOREST_CV_FOLDS', 5))
+FOREST_P99_BUDGET_MS = float(os.getenv('FOREST_P99_BUDGET_MS', 20))
+
+def build_linear_classifier():
+    """
+    Create the linear classifier trained on the sparse Word2Vec and TF-IDF features.
+
+    Returns:
+        LogisticRegression: An unfitted linear classifier.
+    """
+    return LogisticRegression(max_iter=1000)
+
+def build_forest_classifier(n_jobs=FOREST_N_JOBS, **params):
+    """
+    Create the RandomForest classifier trained on the dense Word2Vec and TF-IDF features.
+
+    Args:
+        n_jobs (int): Cores used to fit and score the trees (-1 uses all cores).
+        **params: Hyperparameters such as n_estimators, max_depth and max_features.
+
+    Returns:
+        RandomForestClassifier: An unfitted forest.
+    """
+    return RandomForestClassifier(n_jobs=n_jobs, random_state=42, **params)
+
+def to_sparse_features(word2vec_features, tfidf_features):
+    """
+    Combine dense Word2Vec features and sparse TF-IDF features into one sparse matrix.
+
+    Args:
+        word2vec_features (np.ndarray): Averaged Word2Vec vectors.
+        tfidf_features (scipy.sparse matrix): TF-IDF features.
+
+    Returns:
+        scipy.sparse.csr_matrix: The combined features, in the same column order as the dense features.
+    """
+    return sp.hstack([sp.csr_matrix(word2vec_features), sp.csr_matrix(tfidf_features)]).tocsr()
+
+def top_predictions(classifier, X):
+    """
+    Get the top class, its probability and the margin over the runner-up for each row.
+
+    Args:
+        classifier: A fitted classifier with predict_proba.
+        X: The feature matrix.
+
+    Returns:
+        tuple: Arrays of predicted labels, confidences and margins.
+    """
+    probability_estimates = classifier.predict_proba(X)
+    best = np.argmax(probability_estimates, axis=1)
+    rows = np.arange(len(best))
+    confidences = probability_estimates[rows, best]
+    if probability_estimates.shape[1] > 1:
+        runner_up = np.partition(probability_estimates, -2, axis=1)[:, -2]
+    else:
+        runner_up = np.zeros(len(best))
+    return classifier.classes_[best], confidences, confidences - runner_up
+
+def cascade_predict(linear_classifier, forest_classifier, X_sparse, margin=CASCADE_MARGIN):
+    """
+    Predict with the linear model and consult the forest only for rows with a low margin.
+
+    Args:
+        linear_classifier: The fitted linear classifier.
+        forest_classifier: The fitted RandomForest classifier.
+        X_sparse (scipy.sparse.csr_matrix): The combined sparse features.
+        margin (float): Minimum probability margin for accepting the linear answer.
+
+    Returns:
+        tuple: Arrays of predicted labels, confidences and a mask of rows answered by the linear model.
+    """
+    labels, confidences, margins = top_predictions(linear_classifier, X_sparse)
+    labels = labels.astype(object)
+    accepted = margins >= margin
+    if not accepted.all():
+        rejected = np.flatnonzero(~accepted)
+        forest_labels, forest_confidences, _ = top_predictions(forest_classifier, X_sparse[rejected].toarray())
+        labels[rejected] = forest_labels
+        confidences[rejected] = forest_confidences
+    return labels, confidences, accepted
+
+def engine_predict(engine, linear_classifier, forest_classifier, X_sparse, margin=CASCADE_MARGIN):
+    """
+    Predict labels and confidences with the selected engine.
+
+    Args:
+        engine (str): One of CLASSIFIER_ENGINES.
+        linear_classifier: The fitted linear classifier, or None if not available.
+        forest_classifier: The fitted RandomForest classifier.
+        X_sparse (scipy.sparse.csr_matrix): The combined sparse features.
+        margin (float): Minimum probability margin for the cascade.
+
+    Returns:
+        tuple: Arrays of predicted labels and confidences.
+
+    Raises:
+        ValueError: If the engine is unknown.
+    """
+    if engine not in CLASSIFIER_ENGINES:
+        raise ValueError(f"Unknown classifier engine: {engine}. Expected one of {', '.join(CLASSIFIER_ENGINES)}.")
+    if engine == 'linear' and linear_classifier is not None:
+        labels, confidences, _ = top_predictions(linear_classifier, X_sparse)
+    elif engine == 'cascade' and linear_classifier is not None:
+        labels, confidences, _ = cascade_predict(linear_classifier, forest_classifier, X_sparse, margin)
+    else:
+        labels, confidences, _ = top_predictions(forest_classifier, X_sparse.toarray())
+    return labels, confidences
+
+def measure_latency(predict_fn, X, max_single_rows=200):
+    """
+    Measure single-row and batch inference latency of a prediction function.
+
+    Args:
+        predict_fn (callable): Function predicting a feature matrix.
+        X: The feature matrix to predict.
+        max_single_rows (int): Maximum number of rows timed one at a time.
+
+    Returns:
+        dict: Single-row p50/p99 latency and batch latency per row, in milliseconds.
+    """
+    single_times = []
+    for row in range(min(X.shape[0], max_single_rows)):
+        started_at = time.perf_counter()
+        predict_fn(X[row:row + 1])
+        single_times.append((time.perf_counter() - started_at) * 1000.0)
+
+    started_at = time.perf_counter()
+    predict_fn(X)
+    batch_time = (time.perf_counter() - started_at) * 1000.0
+
+    return {
+        "single_p50_ms": float(np.percentile(single_times, 50)) if single_times else 0.0,
+        "single_p99_ms": float(np.percentile(single_times, 99)) if single_times else 0.0,
+        "batch_ms_per_row": batch_time / max(1, X.shape[0]),
+    }
@@ -1,12 +1,28 @@
 import re
+from functools import lru_cache
 import nltk
 from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
 
-# Download necessary NLTK data
-nltk.download('stopwords')
-nltk.download('wordnet')
-nltk.download('punkt')
+# Download necessary NLTK data if it is not installed yet
+for resource, path in [('stopwords', 'corpora/stopwords'), ('wordnet', 'corpora/wordnet'), ('punkt', 'tokenizers/punkt')]:
+    try:
+        nltk.data.find(path)
+    except LookupError:
+        nltk.download(resource)
+
+# Build the lemmatizer once per process; preprocess_text runs on every request
+lemmatizer = WordNetLemmatizer()
+
+@lru_cache(maxsize=1)
+def get_stop_words():
+    """
+    Load the English stop words set once per process.
+    
+    Returns:
+        set: The English stop words.
+    """
+    return set(stopwords.words('english'))
 
 def preprocess_text(text):
     """
@@ -19,9 +35,7 @@ def preprocess_text(text):
     Returns:
         str: The preprocessed text.
     """
-    # Initialize the lemmatizer and stop words
-    lemmatizer = WordNetLemmatizer()
-    stop_words = set(stopwords.words('english'))
+    stop_words = get_stop_words()
     
     # Remove special characters and digits using regex
     text = re.sub(r'[^a-zA-Z\s]', '', text, re.I | re.A)
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from database.repositories import stream_service_requests
+from scripts.data_preprocessing import preprocess_text
+
+# How often confirmed feedback is merged into the index, and how strongly labels must agree
+EXACT_MATCH_REFRESH_SECONDS = float(os.getenv('EXACT_MATCH_REFRESH_SECONDS', 300))
+EXACT_MATCH_MIN_AGREEMENT = float(os.getenv('EXACT_MATCH_MIN_AGREEMENT', 0.6))
+
+def count_labels(descriptions_processed, categories):
+    """
+    Count the labels seen for each preprocessed description.
+
+    Args:
+        descriptions_processed (iterable): Preprocessed service descriptions.
+        categories (iterable): The category of each description.
+
+    Returns:
+        dict: Preprocessed description to a Counter of category names.
+    """
+    counts = defaultdict(Counter)
+    for description_processed, category in zip(descriptions_processed, categories):
+        if description_processed and isinstance(category, str) and category.strip():
+            counts[description_processed][category.lower().strip()] += 1
+    return dict(counts)
+
+def build_exact_match_index(label_counts):
+    """
+    Build the exact-match index from label counts.
+
+    Args:
+        label_counts (dict): Preprocessed description to a Counter of category names.
+
+    Returns:
+        dict: Preprocessed description to its majority category, agreement count and total count.
+    """
+    index = {}
+    for description_processed, counter in label_counts.items():
+        category, agreement = counter.most_common(1)[0]
+        index[description_processed] = {
+            "category": category,
+            "count": agreement,
+            "total": sum(counter.values()),
+        }
+    return index
+
+def merge_label_counts(*label_counts):
+    """
+    Merge several label count tables.
+
+    Args:
+        *label_counts (dict): Preprocessed description to a Counter of category names.
+
+    Returns:
+        dict: The combined label counts.
+    """
+    merged = defaultdict(Counter)
+    for counts in label_counts:
+        for description_processed, counter in counts.items():
+            merged[description_processed].update(counter)
+    return dict(merged)
+
+def fetch_feedback_label_counts(after_id=0):
+    """
+    Count the user-confirmed categories of the feedback rows added after a watermark.
+
+    Args:
+        after_id (int): Id of the last feedback row already counted.
+
+    Returns:
+        tuple: Preprocessed description to a Counter of confirmed category names, and the new watermark.
+    """
+    counts = {}
+    for chunk in stream_service_requests(after_id=after_id, feedback_only=True):
+        after_id = int(chunk['id'].max())
+        chunk = chunk.dropna(subset=['confirmed_category'])
+        counts = merge_label_counts(counts, count_labels(
+            (preprocess_text(description) for description in chunk['service_description']),
+            chunk['confirmed_category']
+        ))
+    return counts, after_id
+
+class ExactMatchIndex:
+    """
+    O(1) lookup of known descriptions, built from the training corpus and
+    refreshed from confirmed feedback in a background thread.
+
+    Each refresh only reads and preprocesses the feedback rows added since the
+    previous one and updates the entries of the descriptions they touch.
+    """
+
+    def __init__(self, training_counts=None):
+        """
+        Args:
+            training_counts (dict, optional): Label counts from the training corpus.
+        """
+        self.training_counts = training_counts or {}
+        self.feedback_counts = {}
+        self.feedback_watermark = 0
+        self.index = build_exact_match_index(self.training_counts)
+        self.refreshed_at = None
+        self._refreshing = threading.Lock()
+
+    def lookup(self, description_processed, min_agreement=EXACT_MATCH_MIN_AGREEMENT):
+        """
+        Look up a preprocessed description.
+
+        Args:
+            description_processed (str): The preprocessed service description.
+            min_agreement (float): Minimum share of labels that must agree with the majority.
+
+        Returns:
+            tuple: The category and its label agreement ratio, or None if not indexed.
+        """
+        self._maybe_refresh()
+        entry = self.index.get(description_processed)
+        if entry is None:
+            return None
+        agreement = entry["count"] / entry["total"]
+        if agreement < min_agreement:
+            return None
+        return entry["category"], agreement
+
+    def refresh(self):
+        """
+        Merge the feedback confirmed since the last refresh into the index.
+        """
+        try:
+            new_counts, self.feedback_watermark = fetch_feedback_label_counts(self.feedback_watermark)
+            for key, counter in new_counts.items():
+                self.feedback_counts.setdefault(key, Counter()).update(counter)
+            # Only the touched entries are replaced, each in a single assignment
+            self.index.update(build_exact_match_index(merge_label_counts(
+                {key: self.training_counts[key] for key in new_counts if key in self.training_counts},
+                {key: self.feedback_counts[key] for key in new_counts}
+            )))
+        except Exception as e:
+            print(f"Error refreshing exact-match index: {e}")
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if self.refreshed_at is not None and now - self.refreshed_at < EXACT_MATCH_REFRESH_SECONDS:
+            return
+        if not self._refreshing.acquire(blocking=False):
+            return
+        self.refreshed_at = now
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, name='exact-match-refresh', daemon=True).start()
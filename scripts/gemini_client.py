@@ -0,0 +1,386 @@
+import os
+import random
+import threading
+import time
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter shared by all threads of a worker.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): Tokens added per second (0 or less disables limiting).
+            capacity (int): Maximum number of tokens that can accumulate.
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=0.0):
+        """
+        Take one token, waiting up to `timeout` seconds for it to become available.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds.
+
+        Returns:
+            bool: True if a token was taken, False otherwise.
+        """
+        if self.rate <= 0:
+            return True
+
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """
+    Circuit breaker that opens after consecutive failures and lets a single
+    probe call through once the reset timeout has elapsed.
+
+    A probe that never reaches the backend must be handed back with
+    release_probe(); a probe that reports nothing within the reset timeout is
+    abandoned and another one is let through.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit.
+            reset_timeout (float): Seconds to stay open before probing again.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = 0.0
+        self._probe_owner = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """
+        Check, without starting a probe, whether calls currently fail fast.
+
+        Returns:
+            bool: True while the circuit is open and the reset timeout has not elapsed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                return now - self._opened_at < self.reset_timeout
+            if self.state == self.HALF_OPEN:
+                return now - self._probe_started_at < self.reset_timeout
+            return False
+
+    def allow(self):
+        """
+        Check whether a call may be attempted.
+
+        Returns:
+            bool: True if the call may proceed, False if it should fail fast.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if (
+                (self.state == self.OPEN and now - self._opened_at >= self.reset_timeout)
+                or (self.state == self.HALF_OPEN and now - self._probe_started_at >= self.reset_timeout)
+            ):
+                self.state = self.HALF_OPEN
+                self._probe_started_at = now
+                self._probe_owner = threading.get_ident()
+                return True
+            return False
+
+    def release_probe(self):
+        """
+        Hand back a probe that ended without reaching the backend, so the next call may probe.
+
+        Only the thread that took the probe can hand it back; for other calls this does nothing.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probe_owner == threading.get_ident():
+                self.state = self.OPEN
+                self._probe_owner = None
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_owner = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_owner = None
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run `fn` for `key` unless an identical call is already in flight, in
+        which case wait for and share its result.
+
+        Args:
+            key (str): The coalescing key.
+            fn (callable): Zero-argument function producing the result.
+            timeout (float, optional): Maximum time a follower waits for the leader.
+
+        Returns:
+            tuple: The result and a flag telling whether it was shared.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait(timeout)
+            return call.result, True
+
+        try:
+            call.result = fn()
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+class GeminiBackend:
+    """
+    Backend that sends prompts to the Google Gemini API.
+    """
+
+    def __init__(self, model_name='gemini-pro', api_key=None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt, timeout):
+        response = self.model.generate_content([prompt], request_options={"timeout": timeout})
+        return response.text
+
+class FakeBackend:
+    """
+    Offline backend for tests and load benchmarks.
+
+    Replies come from `responder(prompt)` after an optional simulated latency,
+    and a configurable fraction of calls raise to exercise failure handling.
+    """
+
+    def __init__(self, responder=None, latency=0.0, failure_rate=0.0):
+        """
+        Args:
+            responder (callable, optional): Maps a prompt to a reply; defaults to 'none'.
+            latency (float): Simulated latency per call in seconds.
+            failure_rate (float): Fraction of calls that raise an error.
+        """
+        self.responder = responder or (lambda prompt: 'none')
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    def generate(self, prompt, timeout):
+        self.calls += 1
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+            if self.latency > timeout:
+                raise TimeoutError("Fake backend timed out")
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("Fake backend failure")
+        return self.responder(prompt)
+
+class GeminiClient:
+    """
+    Resilient client around a generative AI backend.
+
+    Calls go through a token-bucket rate limiter, a concurrency cap, a circuit
+    breaker and single-flight coalescing of identical prompts. Every failure
+    path returns None quickly so callers can fall back to the local model.
+    """
+
+    def __init__(self, backend, timeout=10.0, rate=5.0, burst=10, max_concurrency=4,
+                 queue_timeout=0.5, max_retries=1, failure_threshold=5, reset_timeout=30.0):
+        """
+        Args:
+            backend: Object with a `generate(prompt, timeout)` method.
+            timeout (float): Per-call timeout in seconds.
+            rate (float): Sustained calls per second allowed by the rate limiter.
+            burst (int): Burst capacity of the rate limiter.
+            max_concurrency (int): Maximum number of calls in flight per worker.
+            queue_timeout (float): Maximum time to wait for a rate or concurrency slot.
+            max_retries (int): Retries after a failed call while the circuit stays closed.
+            failure_threshold (int): Consecutive failures that open the circuit.
+            reset_timeout (float): Seconds the circuit stays open before probing.
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.single_flight = SingleFlight()
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "coalesced": 0,
+            "short_circuited": 0,
+            "rate_limited": 0,
+            "concurrency_limited": 0,
+            "deadline_skipped": 0,
+        }
+
+    def generate(self, prompt, timeout=None):
+        """
+        Generate a reply for the prompt.
+
+        Args:
+            prompt (str): The input prompt.
+            timeout (float, optional): Time left for the call, capped by the configured timeout.
+
+        Returns:
+            str: The reply text, or None if the call failed or was rejected.
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        if timeout <= 0:
+            self._count("deadline_skipped")
+            return None
+        result, shared = self.single_flight.do(prompt, lambda: self._call(prompt, timeout), timeout=timeout)
+        if shared:
+            self._count("coalesced")
+        return result
+
+    def stats(self):
+        """
+        Return client counters and the circuit breaker state.
+
+        Returns:
+            dict: Call counters and breaker state.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["circuit_state"] = self.breaker.state
+        return stats
+
+    def _call(self, prompt, timeout):
+        # Queueing, every attempt and the backoff between attempts share one time budget
+        deadline = time.monotonic() + timeout
+        queue_timeout = min(self.queue_timeout, timeout)
+        # Fail fast without queueing while the circuit is open
+        if self.breaker.is_open():
+            self._count("short_circuited")
+            return None
+        if not self.rate_limiter.acquire(queue_timeout):
+            self._count("rate_limited")
+            return None
+        if not self._slots.acquire(timeout=queue_timeout):
+            self._count("concurrency_limited")
+            return None
+
+        # Only take the half-open probe once the call holds its slots and can reach the backend
+        if not self.breaker.allow():
+            self._slots.release()
+            self._count("short_circuited")
+            return None
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._count("deadline_skipped")
+                    self.breaker.release_probe()
+                    break
+                self._count("calls")
+                started_at = time.monotonic()
+                try:
+                    result = self.backend.generate(prompt, remaining)
+                    self.breaker.record_success()
+                    self._count("successes")
+                    return result
+                except Exception as e:
+                    print(f"Error generating query (attempt {attempt + 1}): {e}")
+                    self._count("failures")
+                    # A call cut short by the caller's deadline says nothing about the provider's health,
+                    # but a probe cut short must still be handed back so the breaker can probe again
+                    if remaining < self.timeout and time.monotonic() - started_at >= remaining:
+                        self.breaker.release_probe()
+                        break
+                    self.breaker.record_failure()
+                    if not self.breaker.allow():
+                        break
+                    time.sleep(max(0.0, min(0.1 * 2 ** attempt, deadline - time.monotonic())))
+            return None
+        finally:
+            self._slots.release()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+def create_gemini_client(backend=None):
+    """
+    Create a Gemini client configured from environment variables.
+
+    Args:
+        backend (optional): Backend to use instead of the one selected by GEMINI_BACKEND.
+
+    Returns:
+        GeminiClient: The configured client.
+    """
+    if backend is None:
+        if os.getenv('GEMINI_BACKEND', 'gemini') == 'fake':
+            backend = FakeBackend(latency=float(os.getenv('GEMINI_FAKE_LATENCY_SECONDS', 0)))
+        else:
+            backend = GeminiBackend(os.getenv('GEMINI_MODEL', 'gemini-pro'), os.getenv('GEMINI_API_KEY'))
+
+    return GeminiClient(
+        backend,
+        timeout=float(os.getenv('GEMINI_TIMEOUT_SECONDS', 10)),
+        rate=float(os.getenv('GEMINI_RATE_PER_SECOND', 5)),
+        burst=int(os.getenv('GEMINI_BURST', 10)),
+        max_concurrency=int(os.getenv('GEMINI_MAX_CONCURRENCY', 4)),
+        queue_timeout=float(os.getenv('GEMINI_QUEUE_TIMEOUT_SECONDS', 0.5)),
+        max_retries=int(os.getenv('GEMINI_MAX_RETRIES', 1)),
+        failure_threshold=int(os.getenv('GEMINI_BREAKER_FAILURES', 5)),
+        reset_timeout=float(os.getenv('GEMINI_BREAKER_RESET_SECONDS', 30))
+    )
@@ -1,14 +1,27 @@
-import google.generativeai as genai
+import json
+import os
+from typing import Literal, Optional
 from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError
 from database.repositories import get_existing_categories
-import os
+from scripts.category_matcher import match_existing_category, remember_suggestion
+from scripts.gemini_client import create_gemini_client
+from scripts.admission import check_deadline, remaining_time
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure generative AI model with API key
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-model = genai.GenerativeModel('gemini-pro')
+# 'single' asks for suggestion, synonym match and verdict in one structured call; 'chain' uses three calls
+GEMINI_MODE = os.getenv('GEMINI_MODE', 'single')
+
+# Rate-limited, circuit-broken client for the generative AI model
+client = create_gemini_client()
+
+class GeminiAssessment(BaseModel):
+    suggested_category: str
+    matched_category: Optional[str] = None
+    verdict: Literal['correct', 'incorrect']
+    reason: str = ''
 
 def generate_query_by_gemini(prompt):
     """
@@ -18,23 +31,30 @@ def generate_query_by_gemini(prompt):
         prompt (str): The input prompt to generate content.
     
     Returns:
-        str: The cleaned JSON response from the model.
+        str: The cleaned JSON response from the model, or None if the model is unavailable.
     """
-    try:
-        response = model.generate_content([prompt])
-        raw_json = response.text
-        cleaned_json = raw_json.replace("json", "").replace("```", "").strip()
-        return cleaned_json
-    except Exception as e:
-        print(f"Error generating query: {e}")
+    raw_json = client.generate(prompt, timeout=remaining_time())
+    if raw_json is None:
         return None
+    cleaned_json = raw_json.replace("json", "").replace("```", "").strip()
+    return cleaned_json
+
+def get_gemini_client_stats():
+    """
+    Return the Gemini client counters for this worker.
+    
+    Returns:
+        dict: Call counters and circuit breaker state.
+    """
+    return client.stats()
 
-def generate_category_by_gemini(service_description):
+def generate_category_by_gemini(service_description, fallback_category=None):
     """
     Generates the most appropriate category for a given home service description.
     
     Args:
         service_description (str): The description of the home service.
+        fallback_category (str, optional): Category returned when the model is unavailable.
     
     Returns:
         str: The suggested or matched category name.
@@ -47,20 +67,32 @@ def generate_category_by_gemini(service_description):
     )
     suggested_category = generate_query_by_gemini(prompt)
 
+    if suggested_category is None and fallback_category:
+        return fallback_category
+
     if not suggested_category or suggested_category.lower() == 'none':
         print("Failed to generate suggested category.")
         return 'none'
 
-    existing_categories = get_existing_categories()
+    remember_suggestion(service_description, suggested_category)
+
+    # Only ask the LLM for synonyms when the local matcher is not confident
+    matched_category = match_existing_category(suggested_category)
+    if matched_category:
+        return matched_category
+
+    check_deadline('database')
+    existing_categories = get_existing_categories(timeout=remaining_time())
 
     if not existing_categories:
         # If no categories exist in the database, return the suggested category
         return suggested_category
 
     # Check for matching category or synonyms
+    category_list = '\n'.join(existing_categories)
     synonym_prompt = (
         f"The suggested category is: '{suggested_category}'. The existing categories are:\n"
-        f"{'\n'.join(existing_categories)}\n\n"
+        f"{category_list}\n\n"
         "Please check if any synonyms or the same categories from the list above match the suggested category. "
         "Return the matching category name if it exists, otherwise return 'none'."
     )
@@ -96,7 +128,7 @@ def verify_predicted_category_is_correct_by_gemini(service_description, predicte
         verification_result = generate_query_by_gemini(prompt)
         
         if verification_result is None:
-            return {"status": "incorrect", "reason": "No response from the Gemini model."}
+            return {"status": "unverified", "reason": "No response from the Gemini model."}
         
         if verification_result == "correct":
             return {"status": "correct", "reason": "The predicted category is verified as correct."}
@@ -104,3 +136,107 @@ def verify_predicted_category_is_correct_by_gemini(service_description, predicte
             return {"status": "incorrect", "reason": "The predicted category does not match the service description."}
     except Exception as e:
         return {"status": "incorrect", "reason": "Error occurred during category verification."}
+
+def parse_gemini_assessment(raw_text):
+    """
+    Parse and validate the structured reply of the single-call assessment prompt.
+    
+    Args:
+        raw_text (str): The raw reply from the model.
+    
+    Returns:
+        GeminiAssessment: The validated assessment, or None if the reply is not valid.
+    """
+    if not raw_text:
+        return None
+    start, end = raw_text.find('{'), raw_text.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(raw_text[start:end + 1])
+        # Tolerate 'Correct.' and a null reason rather than discard an otherwise valid reply
+        data['verdict'] = str(data.get('verdict') or '').strip().rstrip('.!').strip().lower()
+        data['reason'] = data.get('reason') or ''
+        return GeminiAssessment(**data)
+    except (ValueError, TypeError, ValidationError) as e:
+        print(f"Error parsing Gemini assessment: {e}")
+        return None
+
+def assess_category_by_gemini(service_description, predicted_category):
+    """
+    Suggest a category, match it to an existing category and verify the predicted
+    category in a single round trip to the Gemini model.
+    
+    Args:
+        service_description (str): The description of the home service.
+        predicted_category (str): The category predicted by the model.
+    
+    Returns:
+        dict: The suggested category, verification status and reason.
+    """
+    check_deadline('database')
+    existing_categories = get_existing_categories(timeout=remaining_time())
+    schema = {
+        "suggested_category": "string, the most appropriate category name, or 'none'",
+        "matched_category": "string, the existing category that is the same as or a synonym of suggested_category, or null",
+        "verdict": "'correct' or 'incorrect', whether the predicted category matches the description",
+        "reason": "string, one short sentence explaining the verdict"
+    }
+    category_list = '\n'.join(existing_categories)
+    prompt = (
+        f"Classify the following home service description: '{service_description}'. "
+        f"Do not include job date, time, or location data in the classification. "
+        f"If the service description contains only date, time, or location data, suggest 'none'.\n"
+        f"The existing categories are:\n{category_list}\n"
+        f"The predicted category is: '{predicted_category}'.\n"
+        f"Respond with a single JSON object and nothing else, using exactly these keys: {json.dumps(schema)}"
+    )
+
+    assessment = parse_gemini_assessment(client.generate(prompt, timeout=remaining_time()))
+    if assessment is None:
+        return {
+            "suggested_category": predicted_category or 'none',
+            "status": "unverified",
+            "reason": "No valid response from the Gemini model."
+        }
+
+    remember_suggestion(service_description, assessment.suggested_category)
+
+    # Only accept a match that is actually one of the existing categories, else try the local matcher
+    categories_by_name = {category.lower(): category for category in existing_categories}
+    matched_category = (
+        categories_by_name.get((assessment.matched_category or '').strip().lower())
+        or match_existing_category(assessment.suggested_category)
+    )
+    suggested_category = matched_category or assessment.suggested_category.strip() or 'none'
+
+    return {
+        "suggested_category": suggested_category,
+        "status": assessment.verdict,
+        "reason": assessment.reason or (
+            "The predicted category is verified as correct." if assessment.verdict == 'correct'
+            else "The predicted category does not match the service description."
+        )
+    }
+
+def review_prediction_by_gemini(service_description, predicted_category):
+    """
+    Get the Gemini suggestion and verification for a prediction using the configured GEMINI_MODE.
+    
+    Args:
+        service_description (str): The description of the home service.
+        predicted_category (str): The category predicted by the model.
+    
+    Returns:
+        dict: The suggested category, verification status and reason.
+    """
+    if GEMINI_MODE == 'single':
+        return assess_category_by_gemini(service_description, predicted_category)
+
+    suggested_category = generate_category_by_gemini(service_description, fallback_category=predicted_category)
+    verification_result = verify_predicted_category_is_correct_by_gemini(service_description, predicted_category)
+    return {
+        "suggested_category": suggested_category,
+        "status": verification_result.get('status', 'unknown'),
+        "reason": verification_result.get('reason', 'N/A')
+    }
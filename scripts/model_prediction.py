@@ -1,102 +1,384 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 from scripts.utils import load_model
 from scripts.data_preprocessing import preprocess_text
+from scripts.prediction_cache import create_prediction_cache
+from scripts.batch_dispatcher import create_batch_dispatcher
+from scripts.classifier_engines import (
+    CASCADE_MARGIN, CLASSIFIER_ENGINE, SIMILARITY_FALLBACK_CONFIDENCE, engine_predict, to_sparse_features
+)
+from scripts.exact_match import ExactMatchIndex
+from scripts.similarity_corpus import SIMILARITY_CORPUS_FILE, SIMILARITY_SCALE_FILE, best_matches, load_similarity_corpus, quantize_corpus
+from scripts.admission import DeadlineExceeded, check_deadline, remaining_time
 from database.repositories import store_service_request, get_category_id
 from train_model import get_average_word2vec
 
-def predict_with_embedding(description):
+# Directory holding the trained artifacts and how often to check them for a retrained set
+MODEL_DIR = os.getenv('MODEL_DIR', 'models')
+MODEL_RELOAD_CHECK_SECONDS = float(os.getenv('MODEL_RELOAD_CHECK_SECONDS', 5))
+
+# Artifacts written by train_model.py that make up one model version
+MODEL_ARTIFACTS = {
+    'word2vec': 'final_word2vec_model.pkl',
+    'tfidf': 'tfidf_vectorizer.pkl',
+    'classifier': 'final_classifier.pkl',
+    'linear_classifier': 'linear_classifier.pkl',
+    'similarity_corpus': SIMILARITY_CORPUS_FILE,
+    'similarity_scale': SIMILARITY_SCALE_FILE,
+    # float64 matrix from older training runs, quantized at load when the corpus above is missing
+    'vectorized_descriptions': 'vectorized_descriptions_combined.npy',
+    'descriptions': 'descriptions_combined.csv',
+    'feature_dims': 'combined_feature_dims.npy',
+    'exact_match_counts': 'exact_match_counts.pkl',
+}
+
+# Memoized prediction results, keyed on the preprocessed description and model version
+prediction_cache = create_prediction_cache()
+
+_model_bundles = {}
+_model_bundle_lock = threading.Lock()
+
+def get_model_version(model_dir=MODEL_DIR):
     """
-    Predict the category of a service description using embedding-based classification.
+    Compute a version fingerprint for the artifacts in a model directory.
     
     Args:
-        description (str): The service description.
+        model_dir (str): The directory containing the trained artifacts.
+    
+    Returns:
+        str: A short hash of the artifact names, sizes and modification times.
+    """
+    parts = []
+    for filename in sorted(MODEL_ARTIFACTS.values()):
+        try:
+            stat = os.stat(os.path.join(model_dir, filename))
+            parts.append(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{filename}:missing")
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:12]
+
+def get_cache_version(model_version):
+    """
+    Combine a model version with the serving settings that change its predictions, so that
+    cached results are not reused after the engine or a threshold changes.
+    
+    Args:
+        model_version (str): The artifact fingerprint from get_model_version.
     
     Returns:
-        tuple: The predicted category and the confidence score.
+        str: A short hash of the model version and the serving settings.
     """
+    settings = f"{model_version}|{CLASSIFIER_ENGINE}|{CASCADE_MARGIN}|{SIMILARITY_FALLBACK_CONFIDENCE}"
+    return hashlib.sha1(settings.encode('utf-8')).hexdigest()[:12]
+
+def _load_array(filename):
     try:
-        # Load models and dimensions
-        final_word2vec_model = load_model('models/final_word2vec_model.pkl')
-        tfidf_vectorizer = load_model('models/tfidf_vectorizer.pkl')
-        final_classifier = load_model('models/final_classifier.pkl')
-        
-        input_vector = get_average_word2vec(description.lower().split(), final_word2vec_model).reshape(1, -1)
-        input_tfidf = tfidf_vectorizer.transform([description]).toarray()
-        combined_input_vector = np.hstack([input_vector, input_tfidf])
-
-        probability_estimates = final_classifier.predict_proba(combined_input_vector)
-        confidence = max(probability_estimates[0])
-        predicted_category = final_classifier.predict(combined_input_vector)[0]
-        
-        if not predicted_category:
-            return None, None
-        return predicted_category, confidence
+        return np.load(filename)
     except Exception as e:
-        print(f"Error in predict_with_embedding: {e}")
-        return None, None
+        print(f"Error loading array: {e}")
+        return None
+
+def _load_descriptions(filename):
+    try:
+        return pd.read_csv(filename)
+    except Exception as e:
+        print(f"Error loading descriptions: {e}")
+        return None
+
+def _load_similarity_corpus(model_dir, legacy_path):
+    corpus, scale = load_similarity_corpus(model_dir)
+    if corpus is None and os.path.exists(legacy_path):
+        # Artifact sets trained before the reduced-precision export only have the float64 matrix
+        vectors = _load_array(legacy_path)
+        if vectors is not None:
+            corpus, scale = quantize_corpus(vectors)
+    return corpus, scale
+
+def load_model_bundle(model_dir=MODEL_DIR):
+    """
+    Load the trained artifacts once per process and reload them when they change on disk.
+    
+    Reloading the default model directory invalidates the prediction cache.
+    
+    Args:
+        model_dir (str): The directory containing the trained artifacts.
+    
+    Returns:
+        dict: The loaded artifacts and their version.
+    """
+    now = time.monotonic()
+    bundle = _model_bundles.get(model_dir)
+    if bundle is not None and now - bundle['checked_at'] < MODEL_RELOAD_CHECK_SECONDS:
+        return bundle
+
+    with _model_bundle_lock:
+        version = get_model_version(model_dir)
+        bundle = _model_bundles.get(model_dir)
+        if bundle is not None and bundle['version'] == version:
+            bundle['checked_at'] = now
+            return bundle
+
+        paths = {name: os.path.join(model_dir, filename) for name, filename in MODEL_ARTIFACTS.items()}
+        similarity_corpus, similarity_scale = _load_similarity_corpus(model_dir, paths['vectorized_descriptions'])
+        bundle = {
+            'version': version,
+            'cache_version': get_cache_version(version),
+            'checked_at': now,
+            'word2vec': load_model(paths['word2vec']),
+            'tfidf': load_model(paths['tfidf']),
+            'classifier': load_model(paths['classifier']),
+            'linear_classifier': load_model(paths['linear_classifier']) if os.path.exists(paths['linear_classifier']) else None,
+            'similarity_corpus': similarity_corpus,
+            'similarity_scale': similarity_scale,
+            'descriptions': _load_descriptions(paths['descriptions']),
+            'feature_dims': _load_array(paths['feature_dims']),
+            'exact_match': ExactMatchIndex(
+                load_model(paths['exact_match_counts']) if os.path.exists(paths['exact_match_counts']) else None
+            ),
+        }
+        if bundle['linear_classifier'] is None and CLASSIFIER_ENGINE != 'forest':
+            print(f"Error loading linear classifier: {paths['linear_classifier']} is missing, so CLASSIFIER_ENGINE={CLASSIFIER_ENGINE} falls back to the forest.")
+        _model_bundles[model_dir] = bundle
+
+        if model_dir == MODEL_DIR:
+            prediction_cache.invalidate(bundle['cache_version'])
+    return bundle
 
-def similarity_based_prediction(description):
+def vectorize_descriptions(descriptions_processed, bundle, sparse=False):
+    """
+    Build the combined Word2Vec and TF-IDF feature matrix for preprocessed descriptions.
+    
+    Args:
+        descriptions_processed (list): The preprocessed service descriptions.
+        bundle (dict): The loaded model bundle.
+        sparse (bool, optional): Return a sparse matrix instead of a dense array.
+    
+    Returns:
+        np.ndarray or scipy.sparse.csr_matrix: The combined features with shape (n_descriptions, n_features).
+    """
+    input_vectors = np.vstack([
+        get_average_word2vec(description_processed.split(), bundle['word2vec'])
+        for description_processed in descriptions_processed
+    ])
+    input_tfidf = bundle['tfidf'].transform(descriptions_processed)
+    if sparse:
+        return to_sparse_features(input_vectors, input_tfidf)
+    return np.hstack([input_vectors, input_tfidf.toarray()])
+
+def vectorize_description(description_processed, bundle):
+    """
+    Build the combined Word2Vec and TF-IDF feature vector for a preprocessed description.
+    
+    Args:
+        description_processed (str): The preprocessed service description.
+        bundle (dict): The loaded model bundle.
+    
+    Returns:
+        np.ndarray: The combined feature vector with shape (1, n_features).
+    """
+    return vectorize_descriptions([description_processed], bundle)
+
+def similarity_based_prediction(description, bundle=None, description_processed=None):
     """
     Predict the category of a service description using similarity-based prediction.
     
     Args:
         description (str): The service description.
+        bundle (dict, optional): The loaded model bundle; the active one is used if omitted.
+        description_processed (str, optional): The already preprocessed description.
     
     Returns:
         tuple: The most similar category and the similarity score.
     """
     try:
-        description_processed = preprocess_text(description)
-        vectorized_descriptions = np.load('models/vectorized_descriptions_combined.npy')
-        descriptions_df = pd.read_csv('models/descriptions_combined.csv')
+        bundle = bundle or load_model_bundle()
+        if description_processed is None:
+            description_processed = preprocess_text(description)
 
-        # Load models and dimensions
-        final_word2vec_model = load_model('models/final_word2vec_model.pkl')
-        tfidf_vectorizer = load_model('models/tfidf_vectorizer.pkl')
-        combined_feature_dims = np.load('models/combined_feature_dims.npy')
+        description_vectorized = vectorize_description(description_processed, bundle)
 
-        word2vec_dim, tfidf_dim = combined_feature_dims
+        indices, similarities = best_matches(bundle['similarity_corpus'], bundle['similarity_scale'], description_vectorized)
+        most_similar_description = bundle['descriptions'].iloc[int(indices[0])]
 
-        # Get Word2Vec features
-        words = description_processed.split()
-        description_vectorized_w2v = np.mean([final_word2vec_model.wv[word] for word in words if word in final_word2vec_model.wv], axis=0).reshape(1, -1)
-        if np.isnan(description_vectorized_w2v).any():
-            description_vectorized_w2v = np.zeros((1, word2vec_dim))
+        return most_similar_description['category'], float(similarities[0])
+    except Exception as e:
+        print(f"Error in similarity_based_prediction: {e}")
+        return None, None
 
-        # Get TF-IDF features
-        description_vectorized_tfidf = tfidf_vectorizer.transform([description_processed]).toarray()
+def predict_processed(descriptions_processed, bundle):
+    """
+    Score preprocessed descriptions as one matrix with the configured CLASSIFIER_ENGINE,
+    falling back to similarity for rows the classifier cannot score or scores below
+    SIMILARITY_FALLBACK_CONFIDENCE.
+    
+    Args:
+        descriptions_processed (list): The preprocessed service descriptions.
+        bundle (dict): The model bundle to score with.
+    
+    Returns:
+        list: The (predicted category, confidence or similarity score, source) tuple of each description,
+            where the source is 'model' or 'similarity'.
+    """
+    results = [(None, None, 'model')] * len(descriptions_processed)
+    try:
+        labels, confidences = engine_predict(
+            CLASSIFIER_ENGINE,
+            bundle.get('linear_classifier'),
+            bundle['classifier'],
+            vectorize_descriptions(descriptions_processed, bundle, sparse=True)
+        )
+        results = [(label, float(confidence), 'model') for label, confidence in zip(labels, confidences)]
+    except Exception as e:
+        print(f"Error in batch prediction: {e}")
 
-        # Combine features
-        description_vectorized = np.hstack([description_vectorized_w2v, description_vectorized_tfidf])
-        print(f"Vectorized description shape: {description_vectorized.shape}")
+    for row, (predicted_category, confidence, _) in enumerate(results):
+        if not predicted_category or confidence < SIMILARITY_FALLBACK_CONFIDENCE:
+            # Keep the classifier answer if the similarity lookup fails
+            similar_category, similarity = similarity_based_prediction(None, bundle, descriptions_processed[row])
+            if similar_category or not predicted_category:
+                results[row] = (similar_category, similarity, 'similarity')
+    return results
 
-        similarities = cosine_similarity(description_vectorized, vectorized_descriptions)
-        most_similar_index = np.argmax(similarities)
-        most_similar_description = descriptions_df.iloc[most_similar_index]
+def predict_categories_details(descriptions):
+    """
+    Predict the categories of several service descriptions in one pass over the models.
+    
+    Descriptions found in the exact-match index are answered directly. Cached results
+    are reused and the remaining unique descriptions are scored as one matrix.
+    
+    Args:
+        descriptions (list): The service descriptions.
+    
+    Returns:
+        list: A dict per description with the category, the confidence and the prediction source
+            ('exact_match', 'model' or 'similarity').
+    """
+    bundle = load_model_bundle()
+    descriptions_processed = [preprocess_text(description) for description in descriptions]
+    results = [None] * len(descriptions)
 
-        return most_similar_description['category'], similarities[0, most_similar_index]
-    except Exception as e:
-        print(f"Error in similarity_based_prediction: {e}")
-        return None, None
+    for row, processed in enumerate(descriptions_processed):
+        exact_match = bundle['exact_match'].lookup(processed)
+        if exact_match is not None:
+            results[row] = {"category": exact_match[0], "confidence": exact_match[1], "source": "exact_match"}
+            continue
+        cached = prediction_cache.get(bundle['cache_version'], processed)
+        if cached is not None:
+            results[row] = {"category": cached[0], "confidence": cached[1], "source": cached[2]}
+
+    pending = list(dict.fromkeys(
+        processed for processed, result in zip(descriptions_processed, results) if result is None
+    ))
+    if pending:
+        predictions = dict(zip(pending, predict_processed(pending, bundle)))
+        for processed, prediction in predictions.items():
+            prediction_cache.put(bundle['cache_version'], processed, prediction)
+        for row, processed in enumerate(descriptions_processed):
+            if results[row] is None:
+                category, confidence, source = predictions[processed]
+                results[row] = {"category": category, "confidence": confidence, "source": source}
+    return results
+
+def predict_category_details(description):
+    """
+    Predict the category of a service description and report how it was predicted.
+    
+    When PREDICT_BATCH_WINDOW_MS is set, concurrent calls are scored together in micro-batches.
+    
+    Args:
+        description (str): The service description.
+    
+    Returns:
+        dict: The category, the confidence and the prediction source ('exact_match', 'model' or 'similarity').
+    
+    Raises:
+        DeadlineExceeded: If the request deadline passes before the prediction is available.
+    """
+    check_deadline('model')
+    if prediction_dispatcher is not None:
+        future = prediction_dispatcher.submit(description)
+        try:
+            return future.result(timeout=remaining_time())
+        except FutureTimeoutError:
+            future.cancel()
+            raise DeadlineExceeded("Request deadline exceeded while waiting for the model.")
+    return predict_categories_details([description])[0]
 
 def predict_category(description):
     """
     Predict the category of a service description using both embedding and similarity-based methods.
     
+    Known descriptions are answered from the exact-match index and other results are
+    memoized per preprocessed description and model version.
+    
     Args:
         description (str): The service description.
     
     Returns:
         tuple: The predicted category and the confidence or similarity score.
     """
-    predicted_category, confidence = predict_with_embedding(description)
+    result = predict_category_details(description)
+    return result['category'], result['confidence']
+
+# Coalesces concurrent prediction calls into batches; None when disabled
+prediction_dispatcher = create_batch_dispatcher(predict_categories_details)
+
+def get_prediction_dispatcher_stats():
+    """
+    Return the micro-batching dispatcher metrics for this worker.
+    
+    Returns:
+        dict: Queue depth, batch size and wait time metrics, or None when batching is disabled.
+    """
+    return prediction_dispatcher.stats() if prediction_dispatcher is not None else None
+
+def get_prediction_cache_stats():
+    """
+    Return the prediction cache statistics for this worker.
     
-    if not predicted_category:
-        predicted_category, confidence = similarity_based_prediction(description)
+    Returns:
+        dict: Cache size, hit/miss counters and hit ratio.
+    """
+    return prediction_cache.stats()
 
-    return predicted_category, confidence
+def get_model_bundle_memory():
+    """
+    Estimate the memory held by each artifact of the loaded model bundles of this worker.
+
+    Arrays report their buffer size (memory-mapped arrays are shared through the page
+    cache) and data frames their deep memory usage. Models and indexes report the size
+    of their pickled artifact file, which is cheap to read and close to their footprint.
+
+    Returns:
+        dict: Model directory to a dict of artifact name to size in bytes.
+    """
+    sizes = {}
+    # Bundle entries loaded from an artifact file under a different name
+    artifact_names = {'exact_match': 'exact_match_counts'}
+    for model_dir, bundle in list(_model_bundles.items()):
+        bundle_sizes = {}
+        for name, value in bundle.items():
+            if value is None or name in ('version', 'cache_version', 'checked_at'):
+                continue
+            try:
+                if isinstance(value, np.memmap):
+                    bundle_sizes[name] = {"mapped_bytes": int(value.nbytes)}
+                elif isinstance(value, np.ndarray):
+                    bundle_sizes[name] = int(value.nbytes)
+                elif isinstance(value, pd.DataFrame):
+                    bundle_sizes[name] = int(value.memory_usage(deep=True).sum())
+                else:
+                    filename = MODEL_ARTIFACTS[artifact_names.get(name, name)]
+                    bundle_sizes[name] = {"file_bytes": os.path.getsize(os.path.join(model_dir, filename))}
+            except Exception as e:
+                bundle_sizes[name] = f"unavailable: {e}"
+        sizes[model_dir] = bundle_sizes
+    return sizes
 
 def confirm_category(service_description, category_name):
     """
@@ -0,0 +1,184 @@
+import os
+import re
+import zlib
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+# Estimated Jaccard similarity of word shingles from which two descriptions count as near-duplicates (0 disables)
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8))
+
+# LSH bands over the signature; more bands find more candidate pairs at lower similarity
+MINHASH_BANDS = int(os.getenv('MINHASH_BANDS', 16))
+
+# Signatures are cached in the training-data snapshot, so changing these requires a snapshot rebuild
+MINHASH_NUM_PERM = 64
+MINHASH_SEED = 1
+
+# Buckets larger than this are verified against their first member only instead of pairwise
+MAX_PAIRWISE_BUCKET = 100
+
+# Texts hashed per block when computing signatures
+SIGNATURE_BLOCK_ROWS = 2048
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+def _permutations(num_perm=MINHASH_NUM_PERM, seed=MINHASH_SEED):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def shingles(text):
+    """
+    Split a description into its set of word unigrams and bigrams.
+
+    Args:
+        text (str): The (preprocessed) description.
+
+    Returns:
+        set: The shingles, or a single empty shingle for empty text.
+    """
+    tokens = re.findall(r'\w+', str(text).lower()) if isinstance(text, str) else []
+    shingle_set = set(tokens)
+    shingle_set.update(' '.join(pair) for pair in zip(tokens, tokens[1:]))
+    return shingle_set or {''}
+
+def minhash_signatures(texts, num_perm=MINHASH_NUM_PERM, seed=MINHASH_SEED):
+    """
+    Compute MinHash signatures of the word shingles of each text.
+
+    Args:
+        texts (iterable): The descriptions.
+        num_perm (int): Number of hash permutations.
+        seed (int): Seed of the permutations.
+
+    Returns:
+        np.ndarray: uint32 signatures with shape (n_texts, num_perm).
+    """
+    a, b = _permutations(num_perm, seed)
+    shingle_hashes = [[zlib.crc32(shingle.encode('utf-8')) for shingle in shingles(text)] for text in texts]
+    signatures = np.zeros((len(shingle_hashes), num_perm), dtype=np.uint32)
+
+    # Hash a block of texts at a time to bound the (num_perm, n_shingles) intermediate
+    for start in range(0, len(shingle_hashes), SIGNATURE_BLOCK_ROWS):
+        block = shingle_hashes[start:start + SIGNATURE_BLOCK_ROWS]
+        lengths = np.array([len(hashes) for hashes in block])
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        hashes = np.fromiter((h for row in block for h in row), dtype=np.uint64, count=int(lengths.sum()))
+
+        # Universal hashing (a * x + b) mod p per permutation, then the minimum per text
+        permuted = ((a[:, None] * hashes[None, :] + b[:, None]) % _MERSENNE_PRIME) & _MAX_HASH
+        signatures[start:start + len(block)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return signatures
+
+def signatures_to_bytes(signatures):
+    return [row.tobytes() for row in signatures]
+
+def signatures_from_bytes(values):
+    return np.vstack([np.frombuffer(value, dtype=np.uint32) for value in values])
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def near_duplicate_clusters(signatures, threshold=NEAR_DUPLICATE_THRESHOLD, bands=MINHASH_BANDS):
+    """
+    Cluster rows whose signatures are near-duplicates, using LSH banding for candidate pairs.
+
+    Args:
+        signatures (np.ndarray): MinHash signatures with shape (n_rows, num_perm).
+        threshold (float): Minimum estimated Jaccard similarity of a near-duplicate pair.
+        bands (int): Number of LSH bands.
+
+    Returns:
+        np.ndarray: A cluster id per row (the index of the cluster's first row).
+    """
+    # Identical signatures are merged up front so LSH buckets only hold distinct ones
+    unique, first_rows, inverse = np.unique(signatures, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    parent = list(range(len(unique)))
+
+    rows_per_band = max(1, unique.shape[1] // bands)
+    for start in range(0, unique.shape[1] - rows_per_band + 1, rows_per_band):
+        buckets = defaultdict(list)
+        for i, band in enumerate(unique[:, start:start + rows_per_band]):
+            buckets[band.tobytes()].append(i)
+        for members in buckets.values():
+            for position, i in enumerate(members[1:], start=1):
+                candidates = members[:position] if len(members) <= MAX_PAIRWISE_BUCKET else members[:1]
+                for j in candidates:
+                    root_i, root_j = _find(parent, i), _find(parent, j)
+                    if root_i != root_j and np.mean(unique[i] == unique[j]) >= threshold:
+                        parent[root_i] = root_j
+
+    roots = np.array([_find(parent, i) for i in range(len(unique))])
+    # Label each cluster by its first row in input order
+    cluster_first_row = {}
+    for root, row in sorted(zip(roots, first_rows), key=lambda pair: pair[1]):
+        cluster_first_row.setdefault(root, row)
+    return np.array([cluster_first_row[root] for root in roots])[inverse]
+
+def _signatures_for(df, text_column):
+    if 'minhash' in df.columns and df['minhash'].notna().all():
+        return signatures_from_bytes(df['minhash'])
+    return minhash_signatures(df[text_column])
+
+def collapse_near_duplicates(df, text_column='processed_description', label_column='category',
+                             threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Collapse each cluster of near-duplicate rows with the same label into one weighted representative.
+
+    Signatures cached in a 'minhash' column are used when present.
+
+    Args:
+        df (pd.DataFrame): The rows to collapse.
+        text_column (str): Column with the descriptions to compare.
+        label_column (str): Rows are only merged with rows of the same label.
+        threshold (float): Minimum estimated Jaccard similarity (0 disables collapsing).
+
+    Returns:
+        pd.DataFrame: The first row of each cluster with a 'weight' column holding the cluster size.
+    """
+    df = df.reset_index(drop=True)
+    if threshold <= 0 or df.empty:
+        collapsed = df.assign(weight=1)
+    else:
+        clusters = near_duplicate_clusters(_signatures_for(df, text_column), threshold)
+        groups = df.groupby([clusters, df[label_column].fillna('')], sort=False)
+        collapsed = df.loc[groups.head(1).index].copy()
+        collapsed['weight'] = groups[label_column].transform('size').loc[collapsed.index].to_numpy()
+        collapsed = collapsed.sort_index().reset_index(drop=True)
+
+    reduction = 1 - len(collapsed) / len(df) if len(df) else 0.0
+    print(f"Near-duplicate collapse: {len(df)} rows -> {len(collapsed)} representatives ({reduction:.1%} fewer).")
+    return collapsed.drop(columns=['minhash'], errors='ignore')
+
+def filter_near_duplicates(new_df, existing_df, text_column='service_description', label_column='category',
+                           threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Drop new rows that near-duplicate an existing row or an earlier new row with the same label.
+
+    Args:
+        new_df (pd.DataFrame): Rows about to be inserted.
+        existing_df (pd.DataFrame): Rows already stored.
+        text_column (str): Column with the descriptions to compare.
+        label_column (str): Rows are only compared with rows of the same label.
+        threshold (float): Minimum estimated Jaccard similarity (0 disables filtering).
+
+    Returns:
+        pd.DataFrame: The new rows that add unique content.
+    """
+    if threshold <= 0 or new_df.empty:
+        return new_df
+    combined = pd.concat([existing_df[[text_column, label_column]], new_df[[text_column, label_column]]], ignore_index=True)
+    clusters = near_duplicate_clusters(minhash_signatures(combined[text_column]), threshold)
+    keys = pd.Series(list(zip(clusters, combined[label_column].fillna(''))))
+
+    # A new row is kept only if it is the first row of its cluster, so stored rows always win
+    keep = ~keys.duplicated().to_numpy()[len(existing_df):]
+    print(f"Near-duplicate filter: {int((~keep).sum())} of {len(new_df)} new rows dropped.")
+    return new_df[keep]
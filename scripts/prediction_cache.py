@@ -0,0 +1,253 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+class PredictionCache:
+    """
+    Bounded LRU cache for prediction results keyed on the preprocessed
+    description and the active model version, which model_prediction combines
+    with the serving settings that change predictions.
+
+    Entries live in an in-process OrderedDict capped both by entry count and by
+    an approximate memory budget. When a SQLite path is given, entries are also
+    written through to a shared store so that every gunicorn worker on the host
+    can reuse results computed by the others.
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=16 * 1024 * 1024, shared_path=None):
+        """
+        Args:
+            max_entries (int): Maximum number of entries kept in memory (0 disables the cache).
+            max_bytes (int): Approximate memory budget for in-memory entries.
+            shared_path (str, optional): Path of a SQLite file shared across workers.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared_path = shared_path or None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._version = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.shared_path:
+            self._init_shared_store()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, version, description_processed):
+        """
+        Look up a cached prediction.
+
+        Args:
+            version (str): The active model version.
+            description_processed (str): The preprocessed service description.
+
+        Returns:
+            tuple: The cached (category, confidence, source), or None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        key = (version, description_processed)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = self._shared_get(version, description_processed)
+        if value is not None:
+            with self._lock:
+                self.shared_hits += 1
+            self._store_local(key, value)
+            return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, version, description_processed, value):
+        """
+        Store a prediction result.
+
+        Args:
+            version (str): The model version that produced the result.
+            description_processed (str): The preprocessed service description.
+            value (tuple): The (category, confidence, source) to cache; the source defaults to 'model'.
+        """
+        if not self.enabled or value is None or value[0] is None:
+            return
+
+        value = (value[0], float(value[1]), value[2] if len(value) > 2 else 'model')
+        self._store_local((version, description_processed), value)
+        self._shared_put(version, description_processed, value)
+
+    def invalidate(self, version):
+        """
+        Drop every entry that does not belong to the given model version.
+
+        Args:
+            version (str): The newly active model version.
+        """
+        with self._lock:
+            if version == self._version:
+                return
+            self._version = version
+            self._entries.clear()
+            self._bytes = 0
+
+        connection = self._shared_connection()
+        if connection is not None:
+            try:
+                with connection:
+                    connection.execute("DELETE FROM prediction_cache WHERE version != ?", (version,))
+            except sqlite3.Error as e:
+                print(f"Error invalidating shared prediction cache: {e}")
+
+    def clear(self):
+        """
+        Remove all in-memory entries and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Return cache statistics for this worker.
+
+        Returns:
+            dict: Entry count, memory usage, hit/miss counters and hit ratio.
+        """
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "shared": self.shared_path is not None,
+                "model_version": self._version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+    def _store_local(self, key, value):
+        size = _entry_size(key, value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= _entry_size(key, previous)
+            self._entries[key] = value
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                old_key, old_value = self._entries.popitem(last=False)
+                self._bytes -= _entry_size(old_key, old_value)
+                self.evictions += 1
+
+    def _init_shared_store(self):
+        connection = self._shared_connection()
+        if connection is None:
+            return
+        try:
+            with connection:
+                # Stores written before the prediction source was cached are dropped, as they are only a cache
+                columns = {row[1] for row in connection.execute("PRAGMA table_info(prediction_cache)")}
+                if columns and 'source' not in columns:
+                    connection.execute("DROP TABLE prediction_cache")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS prediction_cache ("
+                    "key TEXT PRIMARY KEY, version TEXT NOT NULL, category TEXT NOT NULL, "
+                    "confidence REAL NOT NULL, source TEXT NOT NULL, stored_at REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_prediction_cache_stored ON prediction_cache(stored_at)"
+                )
+        except sqlite3.Error as e:
+            print(f"Error initializing shared prediction cache: {e}")
+            self.shared_path = None
+
+    def _shared_connection(self):
+        if not self.shared_path:
+            return None
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            try:
+                connection = sqlite3.connect(self.shared_path, timeout=1.0)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                self._local.connection = connection
+            except sqlite3.Error as e:
+                print(f"Error opening shared prediction cache: {e}")
+                return None
+        return connection
+
+    def _shared_get(self, version, description_processed):
+        connection = self._shared_connection()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute(
+                "SELECT category, confidence, source FROM prediction_cache WHERE key = ?",
+                (_shared_key(version, description_processed),)
+            ).fetchone()
+            return tuple(row) if row else None
+        except sqlite3.Error as e:
+            print(f"Error reading shared prediction cache: {e}")
+            return None
+
+    def _shared_put(self, version, description_processed, value):
+        connection = self._shared_connection()
+        if connection is None:
+            return
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO prediction_cache (key, version, category, confidence, source, stored_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (_shared_key(version, description_processed), version, value[0], value[1], value[2], time.time())
+                )
+                # Trim the shared store to the same entry budget as the local one
+                connection.execute(
+                    "DELETE FROM prediction_cache WHERE key IN ("
+                    "SELECT key FROM prediction_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            print(f"Error writing shared prediction cache: {e}")
+
+def _shared_key(version, description_processed):
+    return hashlib.sha1(f"{version}\0{description_processed}".encode('utf-8')).hexdigest()
+
+def _entry_size(key, value):
+    return sys.getsizeof(key[0]) + sys.getsizeof(key[1]) + sys.getsizeof(value[0]) + sys.getsizeof(value[2]) + 64
+
+def create_prediction_cache():
+    """
+    Create a prediction cache configured from environment variables.
+
+    Returns:
+        PredictionCache: The configured cache.
+    """
+    return PredictionCache(
+        max_entries=int(os.getenv('PREDICTION_CACHE_SIZE', 4096)),
+        max_bytes=int(os.getenv('PREDICTION_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+        shared_path=os.getenv('PREDICTION_CACHE_PATH')
+    )
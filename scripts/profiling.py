@@ -0,0 +1,286 @@
+import cProfile
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Token expected in the X-Admin-Token header of admin endpoints and profiled requests (unset disables them)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+# Header asking to profile a single request ('cprofile' or 'sampling')
+PROFILE_HEADER = 'X-Profile'
+
+# Where profiles are written, the most requests one toggle may cover and the sampling interval
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_REQUESTS = int(os.getenv('PROFILE_MAX_REQUESTS', 100))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5))
+
+# Start tracemalloc at import so that memory snapshots include the model bundle (adds overhead to every allocation)
+PROFILE_TRACEMALLOC = os.getenv('PROFILE_TRACEMALLOC', '0') == '1'
+
+# Snapshots after which tracemalloc is stopped again (0 keeps it running until it is stopped explicitly)
+PROFILE_MEMORY_MAX_SNAPSHOTS = int(os.getenv('PROFILE_MEMORY_MAX_SNAPSHOTS', 5))
+
+PROFILE_MODES = ('cprofile', 'sampling')
+
+if PROFILE_TRACEMALLOC:
+    tracemalloc.start()
+
+def is_admin(headers):
+    """
+    Check the admin token of a request.
+
+    Args:
+        headers: The request headers.
+
+    Returns:
+        bool: True if ADMIN_TOKEN is set and the request carries it.
+    """
+    token = headers.get(ADMIN_TOKEN_HEADER, '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at a fixed interval and counts the folded stacks.
+    """
+
+    def __init__(self, thread_id, interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        """
+        Args:
+            thread_id (int): Identifier of the thread to sample.
+            interval_ms (float): Time between samples in milliseconds.
+        """
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000.0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        """
+        Write the samples in folded-stack format, one 'frame;frame;frame count' line per stack.
+
+        Args:
+            path (str): The output file.
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+class RequestProfiler:
+    """
+    Per-worker, opt-in request profiler.
+
+    An admin arms it for the next N requests, or a single request asks for a
+    profile with the X-Profile header. While it is not armed, the only cost per
+    request is one counter check.
+    """
+
+    def __init__(self, profile_dir=PROFILE_DIR, max_memory_snapshots=PROFILE_MEMORY_MAX_SNAPSHOTS):
+        self.profile_dir = profile_dir
+        self.max_memory_snapshots = max_memory_snapshots
+        self.mode = None
+        self.remaining = 0
+        self.written = 0
+        self.memory_snapshots = 0
+        self._lock = threading.Lock()
+        # One profiled request at a time per worker keeps profiles from overlapping
+        self._active = threading.Lock()
+
+    def arm(self, mode, requests):
+        """
+        Profile the next requests handled by this worker.
+
+        Args:
+            mode (str): 'cprofile' or 'sampling'.
+            requests (int): Number of requests to profile, capped by PROFILE_MAX_REQUESTS (0 disarms).
+
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}. Expected one of {', '.join(PROFILE_MODES)}.")
+        with self._lock:
+            self.mode = mode
+            self.remaining = max(0, min(int(requests), PROFILE_MAX_REQUESTS))
+
+    def start(self, requested_mode=None):
+        """
+        Start profiling the current request if the profiler is armed or the request asks for it.
+
+        Args:
+            requested_mode (str, optional): Mode requested by an admin through the X-Profile header.
+
+        Returns:
+            tuple: The mode and the running profiler, or None if the request is not profiled.
+        """
+        armed = requested_mode not in PROFILE_MODES
+        # Unlocked read so that requests pay nothing while the profiler is disarmed
+        if armed and self.remaining <= 0:
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        if armed:
+            with self._lock:
+                if self.remaining <= 0:
+                    self._active.release()
+                    return None
+                self.remaining -= 1
+                requested_mode = self.mode
+
+        if requested_mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = SamplingProfiler(threading.get_ident())
+            profiler.start()
+        return requested_mode, profiler
+
+    def stop(self, session, label):
+        """
+        Stop a profile started by start() and write it to PROFILE_DIR.
+
+        Args:
+            session (tuple): The value returned by start().
+            label (str): Short description of the request, used in the file name.
+
+        Returns:
+            str: The name of the written file.
+        """
+        mode, profiler = session
+        try:
+            if mode == 'cprofile':
+                profiler.disable()
+            else:
+                profiler.stop()
+
+            if mode == 'cprofile':
+                filename = self._filename(mode, label, 'prof')
+                profiler.dump_stats(self._path(filename))
+            else:
+                filename = self._filename(mode, label, 'folded')
+                profiler.dump(self._path(filename))
+            with self._lock:
+                self.written += 1
+            return filename
+        except Exception as e:
+            print(f"Error writing profile: {e}")
+            return None
+        finally:
+            self._active.release()
+
+    def snapshot_memory(self, components=None, top=50):
+        """
+        Write a tracemalloc snapshot and a report of the largest allocation sites.
+
+        Tracing is started on the first call when PROFILE_TRACEMALLOC is off, so only
+        allocations made after that call are included in later snapshots. It is stopped
+        again after PROFILE_MEMORY_MAX_SNAPSHOTS snapshots or by stop_memory_tracing().
+
+        Args:
+            components (dict, optional): Sizes of known per-worker structures to include in the report.
+            top (int): Number of allocation sites in the report.
+
+        Returns:
+            dict: The report, including the names of the written files.
+        """
+        report = {"pid": os.getpid(), "components": components or {}}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            with self._lock:
+                self.memory_snapshots = 0
+            report["tracing"] = "started; allocations are tracked from now on, take another snapshot later"
+            return report
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot_file = self._filename('memory', 'tracemalloc', 'tracemalloc')
+        snapshot.dump(self._path(snapshot_file))
+        report.update({
+            "tracing": "active",
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "top_allocations": [
+                {"site": str(stat.traceback), "bytes": stat.size, "blocks": stat.count}
+                for stat in snapshot.statistics('lineno')[:top]
+            ],
+        })
+        with self._lock:
+            self.memory_snapshots += 1
+            limit_reached = 0 < self.max_memory_snapshots <= self.memory_snapshots
+        if limit_reached:
+            tracemalloc.stop()
+            report["tracing"] = f"stopped after {self.max_memory_snapshots} snapshots"
+        report_file = self._filename('memory', 'report', 'json')
+        with open(self._path(report_file), 'w') as f:
+            json.dump(report, f, indent=2)
+        report["files"] = [snapshot_file, report_file]
+        return report
+
+    def stop_memory_tracing(self):
+        """
+        Stop tracemalloc and free its traces, removing its overhead from every allocation.
+
+        Returns:
+            bool: True if tracing was running.
+        """
+        tracing = tracemalloc.is_tracing()
+        tracemalloc.stop()
+        with self._lock:
+            self.memory_snapshots = 0
+        return tracing
+
+    def list_profiles(self):
+        """
+        List the profile files written to PROFILE_DIR.
+
+        Returns:
+            list: File names, newest first.
+        """
+        if not os.path.isdir(self.profile_dir):
+            return []
+        return sorted(os.listdir(self.profile_dir), reverse=True)
+
+    def status(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "mode": self.mode,
+                "remaining_requests": self.remaining,
+                "profiles_written": self.written,
+                "tracemalloc": tracemalloc.is_tracing(),
+                "memory_snapshots": self.memory_snapshots,
+                "files": self.list_profiles(),
+            }
+
+    def _filename(self, mode, label, extension):
+        label = re.sub(r'[^A-Za-z0-9_-]+', '_', label).strip('_') or 'request'
+        return f"{time.strftime('%Y%m%dT%H%M%S')}-{time.time_ns() % 1_000_000_000:09d}-{os.getpid()}-{mode}-{label}.{extension}"
+
+    def _path(self, filename):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        return os.path.join(self.profile_dir, filename)
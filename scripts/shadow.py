@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scripts.data_preprocessing import preprocess_text
+from scripts.model_prediction import MODEL_DIR, load_model_bundle, predict_processed
+
+# Candidate artifact set scored next to the active one (unset disables shadow mode), share of
+# /predict traffic it sees, and the append-only log of its results
+SHADOW_MODEL_DIR = os.getenv('SHADOW_MODEL_DIR', '')
+SHADOW_SAMPLE_RATE = float(os.getenv('SHADOW_SAMPLE_RATE', 0.1))
+SHADOW_LOG_PATH = os.getenv('SHADOW_LOG_PATH', 'logs/shadow.jsonl')
+
+# Background scoring threads, and the backlog above which sampled requests are dropped
+SHADOW_MAX_WORKERS = int(os.getenv('SHADOW_MAX_WORKERS', 1))
+SHADOW_MAX_PENDING = int(os.getenv('SHADOW_MAX_PENDING', 100))
+
+def description_key(description_processed):
+    """
+    Short, stable key of a preprocessed description, so the log holds no raw text.
+
+    Args:
+        description_processed (str): The preprocessed service description.
+
+    Returns:
+        str: The key.
+    """
+    return hashlib.sha1(description_processed.encode('utf-8')).hexdigest()[:16]
+
+class ShadowEvaluator:
+    """
+    Scores a sample of requests with a candidate model bundle off the request path.
+
+    Sampled descriptions are scored by the candidate bundle in a background thread
+    and compared with the prediction actually served. The active model is timed on
+    the same description for the latency delta. Predictions, latencies and every
+    confirmed category are appended to a JSONL log that summarize_shadow_log()
+    reads, so feedback is matched to predictions whichever worker logged them.
+    """
+
+    def __init__(self, candidate_dir, sample_rate=SHADOW_SAMPLE_RATE, log_path=SHADOW_LOG_PATH,
+                 max_workers=SHADOW_MAX_WORKERS, max_pending=SHADOW_MAX_PENDING, active_dir=MODEL_DIR):
+        """
+        Args:
+            candidate_dir (str): Directory of the candidate artifacts.
+            sample_rate (float): Fraction of requests scored by the candidate.
+            log_path (str): Path of the append-only JSONL log.
+            max_workers (int): Background scoring threads.
+            max_pending (int): Backlog above which sampled requests are dropped.
+            active_dir (str): Directory of the active artifacts.
+        """
+        self.candidate_dir = candidate_dir
+        self.active_dir = active_dir
+        self.sample_rate = sample_rate
+        self.log_path = log_path
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max_pending
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._stats = {"sampled": 0, "dropped": 0, "scored": 0, "disagreements": 0, "feedback": 0, "errors": 0}
+
+    def submit(self, description, served):
+        """
+        Maybe queue a description for shadow scoring; returns immediately.
+
+        Args:
+            description (str): The service description.
+            served (dict): The served prediction, with its category, confidence and source.
+        """
+        if random.random() >= self.sample_rate:
+            return
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["dropped"] += 1
+                return
+            self._pending += 1
+            self._stats["sampled"] += 1
+        self._submit(self._score, description, served)
+
+    def record_feedback(self, description, confirmed_category):
+        """
+        Log a confirmed category; returns immediately.
+
+        Args:
+            description (str): The service description.
+            confirmed_category (str): The category confirmed by the user.
+        """
+        self._submit(self._feedback, description, confirmed_category)
+
+    def stats(self):
+        """
+        Return shadow counters for this worker.
+
+        Returns:
+            dict: Sampling, drop, scoring, disagreement, feedback and error counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+        stats.update({"candidate_dir": self.candidate_dir, "sample_rate": self.sample_rate})
+        return stats
+
+    def _submit(self, fn, *args):
+        # Threads do not survive a fork, so each gunicorn worker starts its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='shadow')
+                self._pid = os.getpid()
+            executor = self._executor
+        executor.submit(fn, *args)
+
+    def _score(self, description, served):
+        try:
+            processed = preprocess_text(description)
+            active_bundle = load_model_bundle(self.active_dir)
+            candidate_bundle = load_model_bundle(self.candidate_dir)
+
+            # Model latency of both bundles on the same description
+            started_at = time.perf_counter()
+            predict_processed([processed], active_bundle)
+            active_ms = (time.perf_counter() - started_at) * 1000.0
+            started_at = time.perf_counter()
+            candidate_category, candidate_confidence, candidate_source = predict_processed([processed], candidate_bundle)[0]
+            candidate_ms = (time.perf_counter() - started_at) * 1000.0
+
+            # The candidate would answer known descriptions from its own exact-match index, as /predict does
+            exact_match = candidate_bundle['exact_match'].lookup(processed)
+            if exact_match is not None:
+                candidate_category, candidate_confidence = exact_match
+                candidate_source = "exact_match"
+
+            agree = _same_category(served['category'], candidate_category)
+            self._append({
+                "type": "prediction",
+                "t": round(time.time(), 3),
+                "key": description_key(processed),
+                "served": served['category'],
+                "served_confidence": _round(served['confidence']),
+                "served_source": served['source'],
+                "active_ms": round(active_ms, 3),
+                "active_version": active_bundle['version'],
+                "candidate": candidate_category,
+                "candidate_confidence": _round(candidate_confidence),
+                "candidate_source": candidate_source,
+                "candidate_ms": round(candidate_ms, 3),
+                "candidate_version": candidate_bundle['version'],
+                "agree": agree,
+            })
+            with self._lock:
+                self._stats["scored"] += 1
+                self._stats["disagreements"] += int(not agree)
+        except Exception as e:
+            print(f"Error in shadow scoring: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _feedback(self, description, confirmed_category):
+        try:
+            key = description_key(preprocess_text(description))
+            self._append({"type": "feedback", "t": round(time.time(), 3), "key": key, "confirmed": confirmed_category})
+            with self._lock:
+                self._stats["feedback"] += 1
+        except Exception as e:
+            print(f"Error logging shadow feedback: {e}")
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._log_lock:
+            os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+            with open(self.log_path, 'a') as f:
+                f.write(line)
+
+def _same_category(first, second):
+    return (first or '').lower().strip() == (second or '').lower().strip()
+
+def _round(value):
+    return None if value is None else round(float(value), 4)
+
+def summarize_shadow_log(log_path=SHADOW_LOG_PATH):
+    """
+    Summarize a shadow log: agreement with the served predictions, latency deltas
+    and the accuracy of the served and candidate predictions against confirmed feedback.
+
+    Feedback is matched to the latest prediction logged for the same description;
+    feedback on descriptions that were not sampled is ignored.
+
+    Args:
+        log_path (str): Path of the JSONL log.
+
+    Returns:
+        dict: The summary per candidate version.
+    """
+    predictions = {}
+    latest_by_key = {}
+    feedback = []
+    with open(log_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('type') == 'prediction':
+                predictions.setdefault(record['candidate_version'], []).append(record)
+                latest_by_key[record['key']] = record
+            elif record.get('type') == 'feedback':
+                feedback.append(record)
+
+    summary = {}
+    for version, records in predictions.items():
+        deltas = np.array([record['candidate_ms'] - record['active_ms'] for record in records])
+        summary[version] = {
+            "predictions": len(records),
+            "agreement": float(np.mean([record['agree'] for record in records])),
+            "active_ms_p50": float(np.percentile([record['active_ms'] for record in records], 50)),
+            "candidate_ms_p50": float(np.percentile([record['candidate_ms'] for record in records], 50)),
+            "latency_delta_ms_p50": float(np.percentile(deltas, 50)),
+            "latency_delta_ms_p99": float(np.percentile(deltas, 99)),
+            "feedback": 0,
+            "served_feedback_accuracy": None,
+            "candidate_feedback_accuracy": None,
+        }
+
+    matched = {}
+    for record in feedback:
+        prediction = latest_by_key.get(record['key'])
+        if prediction is not None:
+            matched.setdefault(prediction['candidate_version'], []).append((prediction, record['confirmed']))
+    for version, pairs in matched.items():
+        summary[version].update({
+            "feedback": len(pairs),
+            "served_feedback_accuracy": float(np.mean([_same_category(p['served'], c) for p, c in pairs])),
+            "candidate_feedback_accuracy": float(np.mean([_same_category(p['candidate'], c) for p, c in pairs])),
+        })
+    return summary
+
+def create_shadow_evaluator():
+    """
+    Create a shadow evaluator configured from environment variables.
+
+    Returns:
+        ShadowEvaluator: The evaluator, or None when SHADOW_MODEL_DIR is not set.
+    """
+    if not SHADOW_MODEL_DIR or SHADOW_SAMPLE_RATE <= 0:
+        return None
+    return ShadowEvaluator(SHADOW_MODEL_DIR)
+
+if __name__ == "__main__":
+    print(json.dumps(summarize_shadow_log(), indent=2))
@@ -0,0 +1,202 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Storage precision of the similarity corpus: 'float16', or 'int8' with a per-row scale
+SIMILARITY_CORPUS_DTYPE = os.getenv('SIMILARITY_CORPUS_DTYPE', 'float16')
+
+# Rows upcast at a time while scoring, which bounds the temporary float32 memory per query
+SIMILARITY_BLOCK_ROWS = int(os.getenv('SIMILARITY_BLOCK_ROWS', 8192))
+
+SIMILARITY_CORPUS_FILE = 'similarity_corpus.npy'
+SIMILARITY_SCALE_FILE = 'similarity_corpus_scale.npy'
+
+def l2_normalize(matrix):
+    """
+    Scale each row to unit L2 norm, leaving all-zero rows as they are.
+
+    Args:
+        matrix (np.ndarray): The matrix to normalize.
+
+    Returns:
+        np.ndarray: The row-normalized matrix as float32.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def quantize_corpus(vectors, dtype=SIMILARITY_CORPUS_DTYPE):
+    """
+    L2-normalize the corpus and store it in reduced precision.
+
+    Args:
+        vectors (np.ndarray): The float64 corpus vectors.
+        dtype (str): 'float16' or 'int8'.
+
+    Returns:
+        tuple: The quantized corpus and the per-row scale (None for float16).
+    """
+    normalized = l2_normalize(vectors)
+    if dtype == 'int8':
+        scale = np.abs(normalized).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        quantized = np.rint(normalized / scale[:, None]).astype(np.int8)
+        return np.ascontiguousarray(quantized), scale.astype(np.float32)
+    if dtype == 'float16':
+        return np.ascontiguousarray(normalized.astype(np.float16)), None
+    raise ValueError(f"Unsupported similarity corpus dtype: {dtype}")
+
+def save_similarity_corpus(vectors, model_dir='models', dtype=SIMILARITY_CORPUS_DTYPE):
+    """
+    Write the reduced-precision corpus (and scale for int8) as memory-mappable .npy files.
+
+    Args:
+        vectors (np.ndarray): The float64 corpus vectors.
+        model_dir (str): The directory to write to.
+        dtype (str): 'float16' or 'int8'.
+
+    Returns:
+        tuple: The quantized corpus and the per-row scale (None for float16).
+    """
+    corpus, scale = quantize_corpus(vectors, dtype)
+    np.save(os.path.join(model_dir, SIMILARITY_CORPUS_FILE), corpus)
+    scale_path = os.path.join(model_dir, SIMILARITY_SCALE_FILE)
+    if scale is not None:
+        np.save(scale_path, scale)
+    elif os.path.exists(scale_path):
+        os.remove(scale_path)
+    return corpus, scale
+
+def load_similarity_corpus(model_dir='models'):
+    """
+    Memory-map the reduced-precision corpus.
+
+    Args:
+        model_dir (str): The directory containing the corpus files.
+
+    Returns:
+        tuple: The memory-mapped corpus and the per-row scale, or (None, None) if not found.
+    """
+    corpus_path = os.path.join(model_dir, SIMILARITY_CORPUS_FILE)
+    scale_path = os.path.join(model_dir, SIMILARITY_SCALE_FILE)
+    if not os.path.exists(corpus_path):
+        return None, None
+    try:
+        corpus = np.load(corpus_path, mmap_mode='r')
+        scale = np.load(scale_path) if corpus.dtype == np.int8 else None
+        return corpus, scale
+    except Exception as e:
+        print(f"Error loading similarity corpus: {e}")
+        return None, None
+
+def dequantize_rows(corpus, scale, rows):
+    """
+    Upcast a slice or selection of corpus rows to float32.
+
+    Args:
+        corpus (np.ndarray): The quantized corpus.
+        scale (np.ndarray): The per-row scale, or None.
+        rows: A slice or index array.
+
+    Returns:
+        np.ndarray: The selected rows as float32.
+    """
+    block = np.asarray(corpus[rows], dtype=np.float32)
+    if scale is not None:
+        block *= scale[rows][:, None]
+    return block
+
+def score_corpus(corpus, scale, queries, block_rows=SIMILARITY_BLOCK_ROWS):
+    """
+    Cosine similarity of queries against the corpus, upcasting one block of rows at a time.
+
+    Args:
+        corpus (np.ndarray): The quantized, L2-normalized corpus.
+        scale (np.ndarray): The per-row scale, or None.
+        queries (np.ndarray): Query vectors with shape (n_queries, n_features).
+        block_rows (int): Corpus rows upcast per block.
+
+    Returns:
+        np.ndarray: Similarities with shape (n_queries, n_corpus_rows).
+    """
+    queries = l2_normalize(np.atleast_2d(queries))
+    scores = np.empty((queries.shape[0], corpus.shape[0]), dtype=np.float32)
+    for start in range(0, corpus.shape[0], block_rows):
+        end = min(start + block_rows, corpus.shape[0])
+        block = np.asarray(corpus[start:end], dtype=np.float32)
+        block_scores = queries @ block.T
+        if scale is not None:
+            block_scores *= scale[start:end]
+        scores[:, start:end] = block_scores
+    return scores
+
+def best_matches(corpus, scale, queries, block_rows=SIMILARITY_BLOCK_ROWS):
+    """
+    Find the most similar corpus row for each query without keeping the full score matrix.
+
+    Args:
+        corpus (np.ndarray): The quantized, L2-normalized corpus.
+        scale (np.ndarray): The per-row scale, or None.
+        queries (np.ndarray): Query vectors with shape (n_queries, n_features).
+        block_rows (int): Corpus rows upcast per block.
+
+    Returns:
+        tuple: Arrays of best row indices and their cosine similarities.
+    """
+    queries = l2_normalize(np.atleast_2d(queries))
+    best_index = np.zeros(queries.shape[0], dtype=np.int64)
+    best_score = np.full(queries.shape[0], -np.inf, dtype=np.float32)
+    for start in range(0, corpus.shape[0], block_rows):
+        end = min(start + block_rows, corpus.shape[0])
+        block_scores = queries @ np.asarray(corpus[start:end], dtype=np.float32).T
+        if scale is not None:
+            block_scores *= scale[start:end]
+        block_best = np.argmax(block_scores, axis=1)
+        block_best_score = block_scores[np.arange(len(block_best)), block_best]
+        improved = block_best_score > best_score
+        best_index[improved] = start + block_best[improved]
+        best_score[improved] = block_best_score[improved]
+    return best_index, best_score
+
+def benchmark_similarity_corpus(vectors, labels, corpus, scale, max_queries=1000, seed=42):
+    """
+    Compare leave-one-out nearest neighbours of the quantized corpus against float64.
+
+    Args:
+        vectors (np.ndarray): The float64 corpus vectors.
+        labels (array-like): The category of each corpus row.
+        corpus (np.ndarray): The quantized corpus.
+        scale (np.ndarray): The per-row scale, or None.
+        max_queries (int): Maximum number of corpus rows used as queries.
+        seed (int): Seed for sampling the query rows.
+
+    Returns:
+        pd.DataFrame: Recall@1 against float64 neighbours, label agreement and storage size.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    labels = np.asarray(labels)
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(vectors), size=min(max_queries, len(vectors)), replace=False)
+
+    # Exact float64 cosine neighbours, excluding each query's own row
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1.0
+    exact = (vectors[query_rows] / norms[query_rows, None]) @ (vectors / norms[:, None]).T
+    exact[np.arange(len(query_rows)), query_rows] = -np.inf
+    exact_best = np.argmax(exact, axis=1)
+
+    approx = score_corpus(corpus, scale, vectors[query_rows]).astype(np.float64)
+    approx[np.arange(len(query_rows)), query_rows] = -np.inf
+    approx_best = np.argmax(approx, axis=1)
+
+    bytes_quantized = corpus.nbytes + (scale.nbytes if scale is not None else 0)
+    return pd.DataFrame([{
+        'dtype': str(corpus.dtype),
+        'queries': len(query_rows),
+        'recall_at_1': float(np.mean(approx_best == exact_best)),
+        'label_agreement_at_1': float(np.mean(labels[approx_best] == labels[exact_best])),
+        'bytes_float64': vectors.nbytes,
+        'bytes_quantized': bytes_quantized,
+        'compression': vectors.nbytes / max(1, bytes_quantized),
+    }]).set_index('dtype')
@@ -0,0 +1,171 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from database.repositories import stream_service_requests
+from scripts.data_preprocessing import preprocess_text
+from scripts.near_duplicates import minhash_signatures, signatures_to_bytes
+
+# Where the preprocessed corpus is cached between retrains, and how it is streamed and processed
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'data/snapshot')
+SNAPSHOT_CHUNK_SIZE = int(os.getenv('SNAPSHOT_CHUNK_SIZE', 5000))
+SNAPSHOT_N_JOBS = int(os.getenv('SNAPSHOT_N_JOBS', -1))
+SNAPSHOT_MAX_PARTS = int(os.getenv('SNAPSHOT_MAX_PARTS', 20))
+
+# Bump when preprocess_text or the MinHash parameters change so that cached rows are processed again
+PREPROCESSING_VERSION = 2
+
+# Below this many new rows, preprocessing in worker processes costs more than it saves
+PARALLEL_MIN_ROWS = 1000
+
+SNAPSHOT_COLUMNS = ['id', 'service_description', 'category', 'confirmed_category', 'is_feedback', 'processed_description', 'minhash']
+
+def _preprocess_batch(texts):
+    return [preprocess_text(text) for text in texts]
+
+def preprocess_descriptions(texts, n_jobs=SNAPSHOT_N_JOBS):
+    """
+    Preprocess descriptions, in parallel across cores for large inputs.
+
+    Args:
+        texts (list): The service descriptions.
+        n_jobs (int): Number of worker processes (-1 uses all cores).
+
+    Returns:
+        list: The preprocessed descriptions, in input order.
+    """
+    texts = list(texts)
+    if len(texts) < PARALLEL_MIN_ROWS or n_jobs == 1:
+        return _preprocess_batch(texts)
+    n_batches = (os.cpu_count() or 1) * 4 if n_jobs < 0 else n_jobs * 4
+    batches = np.array_split(np.array(texts, dtype=object), n_batches)
+    results = Parallel(n_jobs=n_jobs)(delayed(_preprocess_batch)(list(batch)) for batch in batches if len(batch))
+    return [text for batch in results for text in batch]
+
+def _part_paths(snapshot_dir):
+    return sorted(glob.glob(os.path.join(snapshot_dir, 'part-*.parquet')))
+
+def _metadata_path(snapshot_dir):
+    return os.path.join(snapshot_dir, 'metadata.json')
+
+def _read_metadata(snapshot_dir):
+    try:
+        with open(_metadata_path(snapshot_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _write_metadata(snapshot_dir, metadata):
+    tmp_path = _metadata_path(snapshot_dir) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, _metadata_path(snapshot_dir))
+
+def _write_part(snapshot_dir, df):
+    path = os.path.join(snapshot_dir, f"part-{int(df['id'].min()):010d}-{int(df['id'].max()):010d}.parquet")
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+def reset_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Delete all cached parts so that the next update rebuilds the snapshot.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+    """
+    for path in _part_paths(snapshot_dir):
+        os.remove(path)
+    _write_metadata(snapshot_dir, {"preprocessing_version": PREPROCESSING_VERSION, "watermark": 0})
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Load the cached, preprocessed training corpus.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+
+    Returns:
+        pd.DataFrame: The snapshot rows in id order.
+    """
+    parts = [pd.read_parquet(path) for path in _part_paths(snapshot_dir)]
+    if not parts:
+        return pd.DataFrame(columns=SNAPSHOT_COLUMNS)
+    return pd.concat(parts, ignore_index=True).sort_values('id').reset_index(drop=True)
+
+def compact_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Merge all parts into one file.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+    """
+    paths = _part_paths(snapshot_dir)
+    if len(paths) <= 1:
+        return
+    new_path = _write_part(snapshot_dir, load_snapshot(snapshot_dir))
+    for path in paths:
+        if path != new_path:
+            os.remove(path)
+
+def update_snapshot(snapshot_dir=SNAPSHOT_DIR, chunksize=SNAPSHOT_CHUNK_SIZE, n_jobs=SNAPSHOT_N_JOBS):
+    """
+    Stream rows added since the last snapshot, preprocess them, compute their MinHash
+    signatures and persist them as a new part.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+        chunksize (int): Rows per database query.
+        n_jobs (int): Number of preprocessing worker processes (-1 uses all cores).
+
+    Returns:
+        pd.DataFrame: The full, up-to-date snapshot.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    metadata = _read_metadata(snapshot_dir)
+    if metadata.get('preprocessing_version') != PREPROCESSING_VERSION:
+        print("Preprocessing changed or no snapshot found; rebuilding the training-data snapshot.")
+        reset_snapshot(snapshot_dir)
+        metadata = _read_metadata(snapshot_dir)
+
+    watermark = metadata.get('watermark', 0)
+    new_rows = 0
+    for chunk in stream_service_requests(after_id=watermark, chunksize=chunksize):
+        chunk['processed_description'] = preprocess_descriptions(chunk['service_description'], n_jobs=n_jobs)
+        chunk['minhash'] = signatures_to_bytes(minhash_signatures(chunk['processed_description']))
+        chunk['is_feedback'] = chunk['is_feedback'].fillna(False).astype(bool)
+        _write_part(snapshot_dir, chunk[SNAPSHOT_COLUMNS])
+        watermark = int(chunk['id'].max())
+        new_rows += len(chunk)
+        metadata['watermark'] = watermark
+        _write_metadata(snapshot_dir, metadata)
+
+    if len(_part_paths(snapshot_dir)) > SNAPSHOT_MAX_PARTS:
+        compact_snapshot(snapshot_dir)
+
+    snapshot = load_snapshot(snapshot_dir)
+    print(f"Training-data snapshot: {new_rows} new rows preprocessed, {len(snapshot)} rows total, watermark {watermark}.")
+    return snapshot
+
+def load_training_data(snapshot_dir=SNAPSHOT_DIR):
+    """
+    Update the snapshot and return the initial (non-feedback) training rows.
+
+    Feedback rows stay in the snapshot but are not returned, so they are not
+    collapsed as near-duplicates either.
+
+    Args:
+        snapshot_dir (str): The snapshot directory.
+
+    Returns:
+        pd.DataFrame: service_description, category, processed_description and minhash columns.
+    """
+    snapshot = update_snapshot(snapshot_dir)
+    data = snapshot[~snapshot['is_feedback'] & snapshot['category'].notna()]
+    return data[['service_description', 'category', 'processed_description', 'minhash']].reset_index(drop=True)
+
+if __name__ == "__main__":
+    update_snapshot()
@@ -0,0 +1,71 @@
+import time
+import scripts.admission as admission
+from scripts.admission import (
+    REQUEST_START_HEADER, REQUEST_TIMEOUT_HEADER, REQUEST_TIMEOUT_MS, AdmissionController,
+    resolve_queue_time, resolve_request_timeout
+)
+
+def test_queue_time_accepts_seconds_milliseconds_and_microseconds():
+    started_at = time.time() - 2.0
+    for value in (f"t={started_at:.3f}", f"{started_at * 1000:.0f}", f"t={started_at * 1e6:.0f}"):
+        assert abs(resolve_queue_time({REQUEST_START_HEADER: value}) - 2.0) < 0.1
+
+def test_queue_time_is_zero_without_a_valid_header_or_in_the_future():
+    assert resolve_queue_time({}) == 0.0
+    assert resolve_queue_time({REQUEST_START_HEADER: 't=soon'}) == 0.0
+    assert resolve_queue_time({REQUEST_START_HEADER: f"t={time.time() + 60:.3f}"}) == 0.0
+
+def test_request_timeout_header_can_shorten_but_not_extend_the_budget():
+    assert resolve_request_timeout({}) == REQUEST_TIMEOUT_MS / 1000.0
+    assert resolve_request_timeout({REQUEST_TIMEOUT_HEADER: '250'}) == 0.25
+    assert resolve_request_timeout({REQUEST_TIMEOUT_HEADER: str(REQUEST_TIMEOUT_MS * 10)}) == REQUEST_TIMEOUT_MS / 1000.0
+    assert resolve_request_timeout({REQUEST_TIMEOUT_HEADER: 'abc'}) == REQUEST_TIMEOUT_MS / 1000.0
+    assert resolve_request_timeout({REQUEST_TIMEOUT_HEADER: '-5'}) == 0.0
+
+def test_request_timeout_subtracts_the_queue_time():
+    headers = {REQUEST_TIMEOUT_HEADER: '5000', REQUEST_START_HEADER: f"t={time.time() - 2.0:.3f}"}
+    assert abs(resolve_request_timeout(headers) - 3.0) < 0.1
+    headers[REQUEST_START_HEADER] = f"t={time.time() - 10.0:.3f}"
+    assert resolve_request_timeout(headers) == 0.0
+
+def test_requests_over_the_in_flight_cap_are_shed():
+    controller = AdmissionController(max_in_flight=2, degrade_in_flight=0, degrade_latency_ms=0)
+    assert controller.try_acquire()
+    assert controller.try_acquire()
+    assert not controller.try_acquire()
+    controller.release(10.0)
+    assert controller.try_acquire()
+    assert (controller.stats()['admitted'], controller.stats()['shed']) == (3, 1)
+
+def test_stale_requests_are_shed():
+    controller = AdmissionController(max_in_flight=0, max_queue_ms=500)
+    assert controller.try_acquire(queue_time=0.4)
+    assert not controller.try_acquire(queue_time=0.6)
+    assert AdmissionController(max_in_flight=0, max_queue_ms=0).try_acquire(queue_time=60.0)
+
+def test_degrades_on_in_flight_requests():
+    controller = AdmissionController(max_in_flight=0, degrade_in_flight=2, degrade_latency_ms=0)
+    controller.try_acquire()
+    assert not controller.should_degrade()
+    controller.try_acquire()
+    assert controller.should_degrade()
+    assert controller.stats()['degraded'] == 1
+
+def test_degrades_on_recent_latency_only(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'monotonic', lambda: now[0])
+    controller = AdmissionController(max_in_flight=0, degrade_in_flight=0, degrade_latency_ms=1000,
+                                     window_seconds=60, min_samples=3)
+    for _ in range(2):
+        controller.try_acquire()
+        controller.release(5000.0)
+    assert not controller.should_degrade()
+
+    controller.try_acquire()
+    controller.release(5000.0)
+    assert controller.should_degrade()
+    assert controller.stats()['latency_p95_ms'] == 5000.0
+
+    now[0] += 61
+    assert not controller.should_degrade()
+    assert controller.stats()['latency_p95_ms'] == 0.0
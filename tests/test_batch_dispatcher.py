@@ -0,0 +1,77 @@
+import threading
+import time
+import pytest
+from scripts.batch_dispatcher import MicroBatchDispatcher, create_batch_dispatcher
+
+class RecordingBatchFn:
+    def __init__(self, gate=None, error=None):
+        self.batches = []
+        self.gate = gate
+        self.error = error
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        if self.gate is not None:
+            self.gate.wait(1.0)
+        if self.error is not None:
+            raise self.error
+        return [item * 10 for item in items]
+
+def test_concurrent_items_are_scored_in_one_batch():
+    batch_fn = RecordingBatchFn()
+    dispatcher = MicroBatchDispatcher(batch_fn, window_ms=100, max_batch_size=32)
+    futures = [dispatcher.submit(item) for item in range(5)]
+    assert [future.result(timeout=1.0) for future in futures] == [0, 10, 20, 30, 40]
+    assert batch_fn.batches == [[0, 1, 2, 3, 4]]
+    stats = dispatcher.stats()
+    assert stats['batches'] == 1
+    assert stats['items'] == 5
+
+def test_batches_are_capped_at_max_batch_size():
+    batch_fn = RecordingBatchFn()
+    dispatcher = MicroBatchDispatcher(batch_fn, window_ms=100, max_batch_size=2)
+    futures = [dispatcher.submit(item) for item in range(5)]
+    assert [future.result(timeout=1.0) for future in futures] == [0, 10, 20, 30, 40]
+    assert [len(batch) for batch in batch_fn.batches] == [2, 2, 1]
+    assert dispatcher.stats()['max_batch_size_seen'] == 2
+
+def test_cancelled_items_are_not_scored():
+    gate = threading.Event()
+    batch_fn = RecordingBatchFn(gate=gate)
+    dispatcher = MicroBatchDispatcher(batch_fn, window_ms=1, max_batch_size=32)
+    first = dispatcher.submit(1)
+    while not batch_fn.batches:
+        time.sleep(0.01)
+
+    # Queued while the first batch is being scored, then abandoned by its caller
+    cancelled = dispatcher.submit(2)
+    assert cancelled.cancel()
+    kept = dispatcher.submit(3)
+    gate.set()
+
+    assert first.result(timeout=1.0) == 10
+    assert kept.result(timeout=1.0) == 30
+    assert batch_fn.batches == [[1], [3]]
+    assert cancelled.cancelled()
+
+def test_batch_errors_are_raised_to_every_caller():
+    batch_fn = RecordingBatchFn(error=RuntimeError("model failure"))
+    dispatcher = MicroBatchDispatcher(batch_fn, window_ms=50, max_batch_size=32)
+    futures = [dispatcher.submit(item) for item in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failure"):
+            future.result(timeout=1.0)
+    assert dispatcher.stats()['errors'] == 1
+
+    # The dispatcher keeps serving after a failed batch
+    batch_fn.error = None
+    assert dispatcher.submit(4).result(timeout=1.0) == 40
+
+def test_dispatcher_is_disabled_without_a_window(monkeypatch):
+    monkeypatch.setenv('PREDICT_BATCH_WINDOW_MS', '0')
+    assert create_batch_dispatcher(RecordingBatchFn()) is None
+    monkeypatch.setenv('PREDICT_BATCH_WINDOW_MS', '2')
+    monkeypatch.setenv('PREDICT_BATCH_MAX_SIZE', '8')
+    dispatcher = create_batch_dispatcher(RecordingBatchFn())
+    assert dispatcher.max_batch_size == 8
+    assert dispatcher.window == pytest.approx(0.002)
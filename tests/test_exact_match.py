@@ -0,0 +1,45 @@
+from collections import Counter
+import pandas as pd
+import scripts.exact_match as exact_match
+from scripts.exact_match import ExactMatchIndex
+
+def use_feedback(monkeypatch, rows):
+    """Serve the given (id, description, confirmed category) rows as the feedback stream."""
+    requests = []
+
+    def stream(after_id=0, chunksize=5000, feedback_only=False):
+        requests.append(after_id)
+        new_rows = [row for row in rows if row[0] > after_id]
+        if new_rows:
+            yield pd.DataFrame(new_rows, columns=['id', 'service_description', 'confirmed_category'])
+
+    monkeypatch.setattr(exact_match, 'stream_service_requests', stream)
+    monkeypatch.setattr(exact_match, 'preprocess_text', lambda text: text.lower())
+    return requests
+
+def test_refresh_merges_feedback_with_training_counts(monkeypatch):
+    use_feedback(monkeypatch, [(1, 'Fix pipe', 'plumbing'), (2, 'Mow lawn', 'landscaping')])
+    index = ExactMatchIndex({'fix pipe': Counter({'plumbing': 2}), 'paint wall': Counter({'painting': 1})})
+    index.refresh()
+
+    assert index.index['fix pipe'] == {"category": 'plumbing', "count": 3, "total": 3}
+    assert index.index['mow lawn']['category'] == 'landscaping'
+    assert index.index['paint wall']['category'] == 'painting'
+    assert index.feedback_watermark == 2
+
+def test_refresh_only_reads_rows_after_the_watermark(monkeypatch):
+    rows = [(1, 'Fix pipe', 'plumbing')]
+    requests = use_feedback(monkeypatch, rows)
+    index = ExactMatchIndex({'fix pipe': Counter({'plumbing': 1})})
+    index.refresh()
+    rows.extend([(2, 'Fix pipe', 'electrical'), (3, 'Fix pipe', 'electrical'), (4, 'Fix pipe', 'electrical'), (5, 'Move sofa', None)])
+    index.refresh()
+
+    assert requests == [0, 1]
+    assert index.index['fix pipe'] == {"category": 'electrical', "count": 3, "total": 5}
+    assert 'move sofa' not in index.index
+    assert index.feedback_watermark == 5
+
+    index.refresh()
+    assert requests == [0, 1, 5]
+    assert index.index['fix pipe']['total'] == 5
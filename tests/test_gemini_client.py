@@ -0,0 +1,188 @@
+import threading
+import time
+from scripts.gemini_client import CircuitBreaker, FakeBackend, GeminiClient, SingleFlight, TokenBucket
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+def test_token_bucket_allows_burst_then_limits():
+    bucket = TokenBucket(rate=1.0, capacity=3)
+    assert all(bucket.acquire() for _ in range(3))
+    assert not bucket.acquire(timeout=0.0)
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=50.0, capacity=1)
+    assert bucket.acquire()
+    assert bucket.acquire(timeout=0.2)
+
+def test_token_bucket_without_rate_is_unlimited():
+    bucket = TokenBucket(rate=0, capacity=1)
+    assert all(bucket.acquire() for _ in range(100))
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open()
+    assert not breaker.allow()
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_breaker_lets_a_single_probe_through_after_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert not breaker.is_open()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.is_open()
+    assert not breaker.allow()
+
+def test_breaker_probe_success_closes_and_failure_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+def test_breaker_released_probe_can_be_taken_again():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
+
+def test_breaker_probe_is_only_released_by_its_owner():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow()
+    thread = threading.Thread(target=breaker.release_probe)
+    thread.start()
+    thread.join()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+def test_breaker_abandoned_probe_times_out():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        release.wait(1.0)
+        return 'result'
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(single_flight.do('key', slow_call, timeout=1.0)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ['result'] * 5
+    assert sum(shared for _, shared in results) == 4
+
+def test_single_flight_runs_again_after_completion():
+    single_flight = SingleFlight()
+    assert single_flight.do('key', lambda: 1) == (1, False)
+    assert single_flight.do('key', lambda: 2) == (2, False)
+
+def test_client_returns_backend_reply():
+    client = GeminiClient(FakeBackend(lambda prompt: prompt.upper()), rate=0)
+    assert client.generate('hello') == 'HELLO'
+    assert client.stats()['successes'] == 1
+
+def test_client_opens_circuit_and_short_circuits():
+    backend = FakeBackend(failure_rate=1.0)
+    client = GeminiClient(backend, rate=0, max_retries=0, failure_threshold=2, reset_timeout=60)
+    assert client.generate('a') is None
+    assert client.generate('b') is None
+    assert client.stats()['circuit_state'] == CircuitBreaker.OPEN
+
+    assert client.generate('c') is None
+    assert backend.calls == 2
+    assert client.stats()['short_circuited'] == 1
+
+def test_client_skips_calls_without_time_left():
+    backend = FakeBackend()
+    client = GeminiClient(backend, rate=0)
+    assert client.generate('a', timeout=0) is None
+    assert backend.calls == 0
+    assert client.stats()['deadline_skipped'] == 1
+
+def test_probe_rejected_for_concurrency_does_not_wedge_breaker():
+    backend = FakeBackend(lambda prompt: 'ok')
+    client = GeminiClient(backend, rate=0, max_concurrency=1, queue_timeout=0.01,
+                          max_retries=0, failure_threshold=1, reset_timeout=0.05)
+    open_breaker(client.breaker)
+    time.sleep(0.06)
+
+    client._slots.acquire()
+    try:
+        assert client.generate('a') is None
+    finally:
+        client._slots.release()
+    assert client.stats()['concurrency_limited'] == 1
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+    assert client.generate('b') == 'ok'
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+def test_probe_rejected_by_rate_limiter_does_not_wedge_breaker():
+    backend = FakeBackend(lambda prompt: 'ok')
+    client = GeminiClient(backend, rate=1.0, burst=1, queue_timeout=0.0,
+                          max_retries=0, failure_threshold=1, reset_timeout=0.05)
+    open_breaker(client.breaker)
+    time.sleep(0.06)
+
+    assert client.rate_limiter.acquire()
+    assert client.generate('a') is None
+    assert client.stats()['rate_limited'] == 1
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+def test_probe_cut_short_by_deadline_is_handed_back():
+    backend = FakeBackend(lambda prompt: 'ok', latency=0.2)
+    client = GeminiClient(backend, timeout=1.0, rate=0, max_retries=0, failure_threshold=1, reset_timeout=0.05)
+    open_breaker(client.breaker)
+    time.sleep(0.06)
+
+    assert client.generate('a', timeout=0.05) is None
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+    assert client.generate('b') == 'ok'
+    assert client.breaker.state == CircuitBreaker.CLOSED
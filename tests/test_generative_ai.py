@@ -0,0 +1,59 @@
+import json
+import scripts.generative_ai as generative_ai
+from scripts.generative_ai import assess_category_by_gemini, parse_gemini_assessment
+
+def reply(**fields):
+    data = {"suggested_category": "Plumbing", "matched_category": "plumbing", "verdict": "correct", "reason": "Pipe repair."}
+    data.update(fields)
+    return json.dumps(data)
+
+def test_plain_reply_is_parsed():
+    assessment = parse_gemini_assessment(reply())
+    assert assessment.suggested_category == 'Plumbing'
+    assert assessment.matched_category == 'plumbing'
+    assert assessment.verdict == 'correct'
+    assert assessment.reason == 'Pipe repair.'
+
+def test_fenced_reply_and_extra_prose_are_tolerated():
+    assert parse_gemini_assessment(f"```json\n{reply()}\n```").verdict == 'correct'
+    assert parse_gemini_assessment(f"Here is the assessment:\n{reply(verdict='incorrect')}\nHope this helps.").verdict == 'incorrect'
+
+def test_verdict_punctuation_and_case_and_null_reason_are_tolerated():
+    assessment = parse_gemini_assessment(reply(verdict=' Correct. ', reason=None))
+    assert assessment.verdict == 'correct'
+    assert assessment.reason == ''
+    assert parse_gemini_assessment(reply(verdict='INCORRECT!')).verdict == 'incorrect'
+
+def test_invalid_replies_are_rejected():
+    assert parse_gemini_assessment(None) is None
+    assert parse_gemini_assessment('no json here') is None
+    assert parse_gemini_assessment('{"suggested_category": "Plumbing", "verdict": }') is None
+    assert parse_gemini_assessment(reply(verdict='maybe')) is None
+    assert parse_gemini_assessment(json.dumps({"verdict": "correct"})) is None
+
+def use_gemini_reply(monkeypatch, text, local_match=None):
+    monkeypatch.setattr(generative_ai.client, 'generate', lambda prompt, timeout=None: text)
+    monkeypatch.setattr(generative_ai, 'get_existing_categories', lambda timeout=None: ['Plumbing', 'Painting'])
+    monkeypatch.setattr(generative_ai, 'match_existing_category', lambda suggestion: local_match)
+    monkeypatch.setattr(generative_ai, 'remember_suggestion', lambda description, suggestion: None)
+
+def test_existing_matched_category_is_used(monkeypatch):
+    use_gemini_reply(monkeypatch, reply(suggested_category='Pipe repair', matched_category='PLUMBING'))
+    result = assess_category_by_gemini('Fix a leaking pipe', 'plumbing')
+    assert result == {"suggested_category": 'Plumbing', "status": 'correct', "reason": 'Pipe repair.'}
+
+def test_non_existent_matched_category_falls_back_to_the_local_matcher(monkeypatch):
+    use_gemini_reply(monkeypatch, reply(suggested_category='Pipe repair', matched_category='Pipework'), local_match='Plumbing')
+    assert assess_category_by_gemini('Fix a leaking pipe', 'plumbing')['suggested_category'] == 'Plumbing'
+
+    use_gemini_reply(monkeypatch, reply(suggested_category='Roofing', matched_category='Roofs', verdict='incorrect', reason=None))
+    result = assess_category_by_gemini('Replace roof tiles', 'plumbing')
+    assert result['suggested_category'] == 'Roofing'
+    assert result['status'] == 'incorrect'
+    assert result['reason'] == "The predicted category does not match the service description."
+
+def test_invalid_reply_is_unverified(monkeypatch):
+    use_gemini_reply(monkeypatch, 'The category is plumbing.')
+    result = assess_category_by_gemini('Fix a leaking pipe', 'plumbing')
+    assert result['status'] == 'unverified'
+    assert result['suggested_category'] == 'plumbing'
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from scripts.near_duplicates import (
+    collapse_near_duplicates, filter_near_duplicates, minhash_signatures, near_duplicate_clusters
+)
+
+def test_identical_texts_get_identical_signatures():
+    signatures = minhash_signatures(['fix leaking kitchen pipe', 'Fix leaking kitchen pipe', 'paint the fence'])
+    assert signatures.shape == (3, 64)
+    assert signatures.dtype == np.uint32
+    assert (signatures[0] == signatures[1]).all()
+    assert not (signatures[0] == signatures[2]).all()
+
+def test_identical_and_near_identical_rows_share_a_cluster():
+    texts = [
+        'fix leaking pipe under kitchen sink today please',
+        'paint living room wall white',
+        'fix leaking pipe under kitchen sink today please',
+        'fix leaking pipe under kitchen sink today please now',
+    ]
+    clusters = near_duplicate_clusters(minhash_signatures(texts), threshold=0.6)
+    assert list(clusters) == [0, 1, 0, 0]
+
+def test_unrelated_rows_are_not_clustered():
+    texts = ['fix leaking pipe', 'paint living room wall', 'mow the front lawn', 'move a sofa upstairs']
+    clusters = near_duplicate_clusters(minhash_signatures(texts), threshold=0.8)
+    assert list(clusters) == [0, 1, 2, 3]
+
+def test_collapse_weights_representatives_and_never_merges_labels():
+    df = pd.DataFrame({
+        'processed_description': ['fix leaking pipe', 'fix leaking pipe', 'fix leaking pipe', 'paint wall'],
+        'category': ['plumbing', 'plumbing', 'handyman', 'painting'],
+    })
+    collapsed = collapse_near_duplicates(df, threshold=0.8)
+    assert collapsed[['category', 'weight']].values.tolist() == [['plumbing', 2], ['handyman', 1], ['painting', 1]]
+
+def test_collapse_is_disabled_at_zero_threshold():
+    df = pd.DataFrame({'processed_description': ['a b', 'a b'], 'category': ['plumbing', 'plumbing']})
+    assert collapse_near_duplicates(df, threshold=0)['weight'].tolist() == [1, 1]
+
+def test_filter_keeps_stored_rows_and_drops_new_duplicates():
+    existing = pd.DataFrame({'service_description': ['Fix leaking pipe'], 'category': ['plumbing']})
+    new = pd.DataFrame({
+        'service_description': ['fix leaking pipe', 'Fix leaking pipe', 'Paint wall', 'paint wall'],
+        'category': ['plumbing', 'handyman', 'painting', 'painting'],
+    })
+    kept = filter_near_duplicates(new, existing, threshold=0.8)
+    assert kept.values.tolist() == [['Fix leaking pipe', 'handyman'], ['Paint wall', 'painting']]
@@ -0,0 +1,110 @@
+import sqlite3
+from scripts.prediction_cache import PredictionCache, _entry_size
+
+def test_get_returns_stored_prediction():
+    cache = PredictionCache(max_entries=4)
+    cache.put('v1', 'fix leaking pipe', ('plumbing', 0.9, 'model'))
+    assert cache.get('v1', 'fix leaking pipe') == ('plumbing', 0.9, 'model')
+    assert cache.get('v2', 'fix leaking pipe') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = PredictionCache(max_entries=2)
+    cache.put('v1', 'a', ('plumbing', 0.9, 'model'))
+    cache.put('v1', 'b', ('painting', 0.8, 'model'))
+    assert cache.get('v1', 'a') is not None
+    cache.put('v1', 'c', ('moving', 0.7, 'model'))
+
+    assert cache.get('v1', 'b') is None
+    assert cache.get('v1', 'a') == ('plumbing', 0.9, 'model')
+    assert cache.get('v1', 'c') == ('moving', 0.7, 'model')
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_are_evicted_to_stay_within_the_memory_budget():
+    entry_bytes = _entry_size(('v1', 'a'), ('plumbing', 0.9, 'model'))
+    cache = PredictionCache(max_entries=100, max_bytes=2 * entry_bytes)
+    for description in ('a', 'b', 'c'):
+        cache.put('v1', description, ('plumbing', 0.9, 'model'))
+
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['bytes'] <= 2 * entry_bytes
+    assert cache.get('v1', 'a') is None
+
+def test_replacing_an_entry_keeps_the_byte_count_exact():
+    cache = PredictionCache(max_entries=4)
+    cache.put('v1', 'a', ('plumbing', 0.9, 'model'))
+    cache.put('v1', 'a', ('electrical', 0.5, 'model'))
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['bytes'] == _entry_size(('v1', 'a'), ('electrical', 0.5, 'model'))
+    assert cache.get('v1', 'a') == ('electrical', 0.5, 'model')
+
+def test_invalidate_drops_entries_of_other_versions():
+    cache = PredictionCache(max_entries=4)
+    cache.invalidate('v1')
+    cache.put('v1', 'a', ('plumbing', 0.9, 'model'))
+    cache.invalidate('v1')
+    assert cache.get('v1', 'a') == ('plumbing', 0.9, 'model')
+
+    cache.invalidate('v2')
+    assert cache.get('v1', 'a') is None
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bytes'] == 0
+    assert cache.stats()['model_version'] == 'v2'
+
+def test_empty_predictions_and_disabled_cache_store_nothing():
+    cache = PredictionCache(max_entries=4)
+    cache.put('v1', 'a', (None, None))
+    assert cache.get('v1', 'a') is None
+
+    disabled = PredictionCache(max_entries=0)
+    disabled.put('v1', 'a', ('plumbing', 0.9, 'model'))
+    assert disabled.get('v1', 'a') is None
+    assert not disabled.stats()['enabled']
+
+def test_shared_store_serves_other_workers_and_is_invalidated(tmp_path):
+    path = str(tmp_path / 'prediction_cache.sqlite3')
+    writer = PredictionCache(max_entries=4, shared_path=path)
+    reader = PredictionCache(max_entries=4, shared_path=path)
+    writer.put('v1', 'a', ('plumbing', 0.9, 'model'))
+
+    assert reader.get('v1', 'a') == ('plumbing', 0.9, 'model')
+    assert reader.stats()['shared_hits'] == 1
+
+    writer.invalidate('v2')
+    fresh = PredictionCache(max_entries=4, shared_path=path)
+    assert fresh.get('v1', 'a') is None
+
+def test_shared_store_is_trimmed_to_the_entry_budget(tmp_path):
+    path = str(tmp_path / 'prediction_cache.sqlite3')
+    writer = PredictionCache(max_entries=2, shared_path=path)
+    for description in ('a', 'b', 'c'):
+        writer.put('v1', description, ('plumbing', 0.9, 'model'))
+
+    count = writer._shared_connection().execute("SELECT COUNT(*) FROM prediction_cache").fetchone()[0]
+    assert count == 2
+
+def test_prediction_source_is_kept_and_defaults_to_model(tmp_path):
+    path = str(tmp_path / 'prediction_cache.sqlite3')
+    writer = PredictionCache(max_entries=4, shared_path=path)
+    writer.put('v1', 'a', ('plumbing', 0.4, 'similarity'))
+    writer.put('v1', 'b', ('painting', 0.8))
+
+    reader = PredictionCache(max_entries=4, shared_path=path)
+    assert reader.get('v1', 'a') == ('plumbing', 0.4, 'similarity')
+    assert reader.get('v1', 'b') == ('painting', 0.8, 'model')
+
+def test_shared_store_without_a_source_column_is_recreated(tmp_path):
+    path = str(tmp_path / 'prediction_cache.sqlite3')
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute(
+            "CREATE TABLE prediction_cache (key TEXT PRIMARY KEY, version TEXT NOT NULL, "
+            "category TEXT NOT NULL, confidence REAL NOT NULL, stored_at REAL NOT NULL)"
+        )
+    connection.close()
+
+    cache = PredictionCache(max_entries=4, shared_path=path)
+    cache.put('v1', 'a', ('plumbing', 0.9, 'model'))
+    assert PredictionCache(max_entries=4, shared_path=path).get('v1', 'a') == ('plumbing', 0.9, 'model')
@@ -1,26 +1,46 @@
+import json
+import os
+import pickle
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import GridSearchCV, KFold, StratifiedKFold, train_test_split
 from sklearn.metrics import classification_report
 from sklearn.feature_extraction.text import TfidfVectorizer
 from gensim.models import Word2Vec
 from scripts.data_preprocessing import preprocess_text
 from scripts.utils import save_model
-from database.repositories import import_csv_to_db, load_initial_data, data_exists_in_db
+from scripts.exact_match import count_labels
+from scripts.classifier_engines import (
+    CASCADE_MARGIN, FOREST_CV_FOLDS, FOREST_N_JOBS, FOREST_P99_BUDGET_MS, FOREST_PARAM_GRID, FOREST_PREDICT_N_JOBS,
+    build_forest_classifier, build_linear_classifier, cascade_predict, measure_latency, to_sparse_features
+)
+from scripts.training_snapshot import load_training_data
+from scripts.near_duplicates import collapse_near_duplicates
+from scripts.similarity_corpus import benchmark_similarity_corpus, save_similarity_corpus
+from database.repositories import import_csv_to_db, data_exists_in_db
+
+# Word2Vec training threads, taken from FOREST_N_JOBS with the same convention (-1 uses all cores)
+WORD2VEC_WORKERS = FOREST_N_JOBS if FOREST_N_JOBS > 0 else max(1, (os.cpu_count() or 1) + 1 + FOREST_N_JOBS)
 
 # Preprocess data
 def preprocess_data(df):
     """
     Preprocess the data by applying text preprocessing and tokenization.
     
+    Rows that already carry a processed description (e.g. from the training-data
+    snapshot) are not preprocessed again.
+    
     Args:
         df (pd.DataFrame): DataFrame containing raw data.
     
     Returns:
         pd.DataFrame: DataFrame with processed text and tokenized descriptions.
     """
-    df['processed_description'] = df['service_description'].apply(preprocess_text)
+    if 'processed_description' not in df.columns:
+        df['processed_description'] = df['service_description'].apply(preprocess_text)
+    missing = df['processed_description'].isna()
+    if missing.any():
+        df.loc[missing, 'processed_description'] = df.loc[missing, 'service_description'].apply(preprocess_text)
     df['tokenized_descriptions'] = df['processed_description'].apply(lambda x: x.lower().split())
     return df
 
@@ -42,6 +62,21 @@ def get_average_word2vec(tokens, model):
     else:
         return np.mean(vectors, axis=0)
 
+# Weight each row by the number of near-duplicates it represents
+def get_sample_weights(df):
+    """
+    Get the sample weight of each row.
+    
+    Args:
+        df (pd.DataFrame): DataFrame, optionally with a 'weight' column from near-duplicate collapsing.
+    
+    Returns:
+        np.ndarray: The weight of each row (1 when the column is missing).
+    """
+    if 'weight' not in df.columns:
+        return np.ones(len(df))
+    return df['weight'].to_numpy(dtype=float)
+
 # Define function for training and evaluating the model with given parameters
 def train_and_evaluate_word2vec(df, vector_size, window, min_count):
     """
@@ -56,20 +91,21 @@ def train_and_evaluate_word2vec(df, vector_size, window, min_count):
     Returns:
         tuple: Trained Word2Vec model, trained classifier, and evaluation score.
     """
-    temp_model = Word2Vec(sentences=df['tokenized_descriptions'], vector_size=vector_size, window=window, min_count=min_count, workers=4)
+    temp_model = Word2Vec(sentences=df['tokenized_descriptions'], vector_size=vector_size, window=window, min_count=min_count, workers=WORD2VEC_WORKERS)
     df['vector'] = df['tokenized_descriptions'].apply(lambda x: get_average_word2vec(x, temp_model))
     X = np.vstack(df['vector'])
     y = df['category']
+    weights = get_sample_weights(df)
     
     # Split the data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train, X_test, y_train, y_test, w_train, w_test = train_test_split(X, y, weights, test_size=0.2, random_state=42)
     
     # Train the classifier
-    temp_classifier = RandomForestClassifier()
-    temp_classifier.fit(X_train, y_train)
+    temp_classifier = build_forest_classifier()
+    temp_classifier.fit(X_train, y_train, sample_weight=w_train)
     
     # Evaluate the classifier
-    temp_score = temp_classifier.score(X_test, y_test)
+    temp_score = temp_classifier.score(X_test, y_test, sample_weight=w_test)
     
     return temp_model, temp_classifier, temp_score
 
@@ -105,6 +141,96 @@ def grid_search_word2vec(data):
                     }
     return best_model, best_classifier, best_params, best_score
 
+# Tune the forest for accuracy within the latency budget
+def tune_forest(X_train, y_train, w_train, X_test, param_grid=FOREST_PARAM_GRID,
+                cv_folds=FOREST_CV_FOLDS, p99_budget_ms=FOREST_P99_BUDGET_MS):
+    """
+    Search forest hyperparameters with cross-validation and measured inference latency.
+    
+    Every candidate is cross-validated in parallel across cores, then refit on the
+    training split and timed on the test rows. The most accurate candidate whose
+    single-row p99 latency fits the budget wins; if none fits, the fastest one does.
+    
+    Args:
+        X_train (np.ndarray): Dense training features.
+        y_train (pd.Series): Training labels.
+        w_train (np.ndarray): Training sample weights.
+        X_test (np.ndarray): Dense test features used for the latency measurements.
+        param_grid (dict): Candidate values of the forest hyperparameters.
+        cv_folds (int): Maximum number of cross-validation folds.
+        p99_budget_ms (float): Single-row p99 latency budget in milliseconds (0 disables it).
+    
+    Returns:
+        tuple: The chosen classifier fitted on the training split, its parameters and the tuning report.
+    """
+    # Stratified folds need at least as many rows per category as folds
+    min_class_count = int(pd.Series(y_train).value_counts().min())
+    if min_class_count >= 2:
+        cv = StratifiedKFold(n_splits=min(cv_folds, min_class_count), shuffle=True, random_state=42)
+    else:
+        cv = KFold(n_splits=min(cv_folds, len(y_train)), shuffle=True, random_state=42)
+
+    # Parallelize across candidates and folds rather than within each forest
+    search = GridSearchCV(build_forest_classifier(n_jobs=1), param_grid, cv=cv, scoring='accuracy', n_jobs=FOREST_N_JOBS, refit=False)
+    search.fit(X_train, y_train, sample_weight=w_train)
+
+    rows = []
+    classifiers = []
+    for params, cv_accuracy, cv_std in zip(search.cv_results_['params'], search.cv_results_['mean_test_score'], search.cv_results_['std_test_score']):
+        classifier = build_forest_classifier(**params)
+        classifier.fit(X_train, y_train, sample_weight=w_train)
+        classifier.set_params(n_jobs=FOREST_PREDICT_N_JOBS)
+        row = {'params': json.dumps(params), 'cv_accuracy': float(cv_accuracy), 'cv_accuracy_std': float(cv_std)}
+        row.update(measure_latency(classifier.predict_proba, X_test))
+        row['model_bytes'] = len(pickle.dumps(classifier))
+        rows.append(row)
+        classifiers.append(classifier)
+
+    report_df = pd.DataFrame(rows)
+    within_budget = report_df['single_p99_ms'] <= p99_budget_ms if p99_budget_ms > 0 else pd.Series(True, index=report_df.index)
+    report_df['within_budget'] = within_budget
+    if within_budget.any():
+        best = report_df[within_budget].sort_values(['cv_accuracy', 'single_p99_ms'], ascending=[False, True]).index[0]
+    else:
+        print(f"No forest candidate meets the {p99_budget_ms} ms p99 budget; choosing the fastest one.")
+        best = report_df['single_p99_ms'].idxmin()
+    report_df['chosen'] = report_df.index == best
+    return classifiers[best], search.cv_results_['params'][best], report_df
+
+# Compare classifier engines side by side
+def compare_engines(forest_classifier, linear_classifier, X_test, X_test_sparse, y_test, margin=CASCADE_MARGIN):
+    """
+    Build an accuracy and latency report for the forest, linear and cascade engines.
+    
+    Args:
+        forest_classifier (RandomForestClassifier): Trained forest on dense features.
+        linear_classifier: Trained linear classifier on sparse features.
+        X_test (np.ndarray): Dense test features.
+        X_test_sparse (scipy.sparse.csr_matrix): Sparse test features.
+        y_test (pd.Series): Test labels.
+        margin (float): Minimum probability margin for the cascade.
+    
+    Returns:
+        pd.DataFrame: One row per engine with accuracy, latency and model size.
+    """
+    def cascade(X):
+        return cascade_predict(linear_classifier, forest_classifier, X, margin)
+
+    engines = {
+        'forest': (forest_classifier.predict, X_test, [forest_classifier]),
+        'linear': (linear_classifier.predict, X_test_sparse, [linear_classifier]),
+        'cascade': (lambda X: cascade(X)[0], X_test_sparse, [forest_classifier, linear_classifier]),
+    }
+    rows = []
+    for name, (predict_fn, X, classifiers) in engines.items():
+        row = {'engine': name, 'accuracy': float(np.mean(predict_fn(X) == np.asarray(y_test)))}
+        row.update(measure_latency(predict_fn, X))
+        row['model_bytes'] = sum(len(pickle.dumps(classifier)) for classifier in classifiers)
+        rows.append(row)
+
+    rows[2]['linear_share'] = float(np.mean(cascade(X_test_sparse)[2]))
+    return pd.DataFrame(rows).set_index('engine')
+
 # Main function to import data and train the model
 def main():
     data_filepath = 'data/raw_data.csv'  # Path to raw data CSV file
@@ -115,10 +241,14 @@ def main():
             # Import CSV data
             import_csv_to_db(data_filepath)
 
-        # Load initial data
-        data = load_initial_data()
+        # Load initial data from the incrementally updated, preprocessed snapshot
+        data = load_training_data()
         data = preprocess_data(data)
 
+        # Exact-match counts keep every description; the models train on near-duplicate representatives
+        exact_match_counts = count_labels(data['processed_description'], data['category'])
+        data = collapse_near_duplicates(data)
+
         # Grid search for the best Word2Vec parameters
         best_model, best_classifier, best_params, best_score = grid_search_word2vec(data)
 
@@ -127,7 +257,7 @@ def main():
         print(f"Best Score: {best_score}")
 
         # Generate the final Word2Vec model with the best parameters
-        final_word2vec_model = Word2Vec(sentences=data['tokenized_descriptions'], vector_size=best_params['vector_size'], window=best_params['window'], min_count=best_params['min_count'], workers=4)
+        final_word2vec_model = Word2Vec(sentences=data['tokenized_descriptions'], vector_size=best_params['vector_size'], window=best_params['window'], min_count=best_params['min_count'], workers=WORD2VEC_WORKERS)
         data['vector'] = data['tokenized_descriptions'].apply(lambda x: get_average_word2vec(x, final_word2vec_model))
 
         # Generate TF-IDF features
@@ -138,33 +268,53 @@ def main():
         word2vec_features = np.vstack(data['vector'])
         combined_features = np.hstack([word2vec_features, tfidf_features.toarray()])
 
-        # Save the vectorized descriptions for similarity-based prediction
-        np.save('models/vectorized_descriptions_combined.npy', combined_features)
+        # Save the vectorized descriptions for similarity-based prediction as a normalized, reduced-precision corpus
+        similarity_corpus, similarity_scale = save_similarity_corpus(combined_features)
         data[['service_description', 'category']].to_csv('models/descriptions_combined.csv', index=False)
 
+        # Check that nearest neighbours in the reduced-precision corpus match the float64 ones
+        similarity_report_df = benchmark_similarity_corpus(combined_features, data['category'], similarity_corpus, similarity_scale)
+        print(similarity_report_df.to_string())
+        similarity_report_df.to_csv('models/similarity_report.csv')
+
         # Prepare features and labels
         X = combined_features
+        X_sparse = to_sparse_features(word2vec_features, tfidf_features)
         y = data['category']
+        weights = get_sample_weights(data)
 
         # Split the data
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        X_train, X_test, X_train_sparse, X_test_sparse, y_train, y_test, w_train, w_test = train_test_split(
+            X, X_sparse, y, weights, test_size=0.2, random_state=42
+        )
 
-        # Train the final classifier
-        final_classifier = RandomForestClassifier()
-        final_classifier.fit(X_train, y_train)
+        # Tune and train the final classifier
+        final_classifier, forest_params, tuning_report_df = tune_forest(X_train, y_train, w_train, X_test)
+        print(f"Forest Parameters: {forest_params}")
+        print(tuning_report_df.to_string())
+        tuning_report_df.to_csv('models/forest_tuning_report.csv', index=False)
 
         # Predict on the test set
         y_pred = final_classifier.predict(X_test)
 
         # Generate the classification report
-        report = classification_report(y_test, y_pred, output_dict=True)
+        report = classification_report(y_test, y_pred, output_dict=True, sample_weight=w_test)
         report_df = pd.DataFrame(report).transpose()
         print(report_df)
 
+        # Train the linear engine on sparse features and compare it with the forest and the cascade
+        linear_classifier = build_linear_classifier()
+        linear_classifier.fit(X_train_sparse, y_train, sample_weight=w_train)
+        engine_report_df = compare_engines(final_classifier, linear_classifier, X_test, X_test_sparse, y_test)
+        print(engine_report_df.to_string())
+        engine_report_df.to_csv('models/engine_report.csv')
+
         # Save the models and feature dimensions
         save_model(final_word2vec_model, 'models/final_word2vec_model.pkl')
         save_model(tfidf_vectorizer, 'models/tfidf_vectorizer.pkl')
         save_model(final_classifier, 'models/final_classifier.pkl')
+        save_model(linear_classifier, 'models/linear_classifier.pkl')
+        save_model(exact_match_counts, 'models/exact_match_counts.pkl')
         np.save('models/combined_feature_dims.npy', np.array([word2vec_features.shape[1], tfidf_features.shape[1]]))
 
         # input_sentence = "I need someone for clean windows home".lower().split()